@@ -0,0 +1,166 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import streamlit as st
+from prompts import PROMPT_VERSION
+from tracing import TRACER
+from settings import get_secret
+
+def normalize_question(text):
+    # Case, whitespace and punctuation only: "  is SKYPAY a scam?? " -> "is skypay a scam".
+    # Keeps question words and order, so "Where is SkyPay?" never matches "What is SkyPay?"
+    return " ".join(re.sub(r"[^\w\s]+", " ", (text or "").lower()).split())
+
+def context_key(ctx, history=()):
+    # Prior turns are part of the key, so an answer shaped by one customer's conversation is never served to another
+    return hashlib.sha1(json.dumps([PROMPT_VERSION, ctx, [list(t) for t in history]]).encode("utf-8")).hexdigest()
+
+# =========================
+# Answer Cache
+# =========================
+class AnswerCache:
+    """Answer cache for customer questions.
+
+    Entries are keyed by the retrieved knowledge context, the prior chat
+    turns and the prompt version, plus the normalized question. Matching is
+    exact up to case, whitespace and punctuation: a fuzzy match would let
+    "Where can I pay?" reuse the answer to "When can I pay?". So only
+    standalone questions (or ones after the same FAQ clicks) are shared
+    between customers. A local TTL/LRU tier is always used; a Mongo collection
+    can be enabled as a shared second tier. Lookups and evictions are recorded
+    as answer_cache.* spans (see cache_summary).
+    """
+
+    def __init__(self, presets=None, max_entries=1000, ttl=6 * 3600, shared=False):
+        self.presets = {normalize_question(q): a for q, a in (presets or {}).items()}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "preset_hits": 0, "shared_hits": 0, "misses": 0,
+                      "stores": 0, "evictions": 0, "expired": 0, "latency_saved": 0.0}
+        self._lock = threading.Lock()
+        if shared:
+            self._init_shared()
+
+    def _init_shared(self):
+        from database import get_db
+        self.collection = get_db().answer_cache
+        self.collection.create_index("created_at", expireAfterSeconds=self.ttl)
+
+    def _local_lookup(self, key, query):
+        entry = self.entries.get((key, query))
+        if entry is None:
+            return None
+        expires, answer, latency = entry
+        if expires < time.monotonic():
+            del self.entries[(key, query)]
+            self.stats["expired"] += 1
+            return None
+        self.entries.move_to_end((key, query))
+        return answer, latency
+
+    def _local_store(self, key, query, answer, latency):
+        self.entries[(key, query)] = (time.monotonic() + self.ttl, answer, latency)
+        self.entries.move_to_end((key, query))
+        evicted = 0
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            evicted += 1
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def lookup(self, prompt, ctx=None, history=()):
+        """Return a cached answer for `prompt`, or None.
+
+        Presets and free-text answers both match up to case, whitespace and
+        punctuation; presets regardless of context. Free-text answers are only
+        reused when the same knowledge
+        context was retrieved after the same prior turns (`history`: (role,
+        content) pairs), and never for an empty context, where follow-up
+        questions would collide.
+        """
+        start = time.perf_counter()
+        answer, outcome, saved = self._lookup(prompt, ctx, history)
+        TRACER.record("answer_cache.lookup", time.perf_counter() - start, {"outcome": outcome, "saved_ms": round(saved * 1000, 1)})
+        return answer
+
+    def _lookup(self, prompt, ctx, history):
+        query = normalize_question(prompt)
+        with self._lock:
+            preset = self.presets.get(query)
+            if preset is not None:
+                self.stats["preset_hits"] += 1
+                return preset, "preset", 0.0
+            if not ctx:
+                self.stats["misses"] += 1
+                return None, "miss", 0.0
+            key = context_key(ctx, history)
+            found = self._local_lookup(key, query)
+            if found:
+                self.stats["hits"] += 1
+                self.stats["latency_saved"] += found[1]
+                return found[0], "hit", found[1]
+
+        if self.shared:
+            try:
+                doc = self.collection.find_one({"_id": f"{key}:{query}"}, {"answer": 1, "latency": 1})
+                if doc is not None:
+                    with self._lock:
+                        self._local_store(key, query, doc["answer"], doc.get("latency", 0.0))
+                        self.stats["shared_hits"] += 1
+                        self.stats["latency_saved"] += doc.get("latency", 0.0)
+                    return doc["answer"], "shared_hit", doc.get("latency", 0.0)
+            except Exception as e:
+                print(f"Answer cache error: {e}")
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None, "miss", 0.0
+
+    def store(self, prompt, ctx, answer, latency=0.0, history=()):
+        query = normalize_question(prompt)
+        if not ctx or not query or not answer:
+            return
+        key = context_key(ctx, history)
+        with self._lock:
+            evicted = self._local_store(key, query, answer, latency)
+            self.stats["stores"] += 1
+        if evicted:
+            TRACER.record("answer_cache.evict", 0.0, {"evicted": evicted})
+        if self.shared:
+            try:
+                self.collection.update_one(
+                    {"_id": f"{key}:{query}"},
+                    {"$set": {"key": key, "query": query, "answer": answer,
+                              "latency": latency, "created_at": datetime.utcnow()}},
+                    upsert=True,
+                )
+            except Exception as e:
+                print(f"Answer cache error: {e}")
+
+    def summary(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self.entries)
+        lookups = stats["hits"] + stats["preset_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        return stats
+
+def cache_summary(spans):
+    # Lookups, hits, LLM time saved and evictions from answer_cache.* spans, across every exporting process
+    lookups = [s for s in spans if s["stage"] == "answer_cache.lookup"]
+    return {
+        "lookups": len(lookups),
+        "hits": sum(1 for s in lookups if s.get("outcome") != "miss"),
+        "latency_saved": sum(s.get("saved_ms", 0) for s in lookups) / 1000,
+        "evictions": sum(s.get("evicted", 0) for s in spans if s["stage"] == "answer_cache.evict"),
+    }
+
+@st.cache_resource
+def get_answer_cache(presets):
+    return AnswerCache(presets, shared=bool(get_secret("ANSWER_CACHE_SHARED", False)))
@@ -1,8 +1,12 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 import os
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 from database import *
+from notifications import LIST_KEY, mark_own_writes, rerun_on_change
+from assets import inject_css_once
+from tracing import TRACER, set_trace_tags, stage_summary, to_jsonl, to_prometheus
+from answer_cache import cache_summary
 
 # Ensure keyup is available for real-time search
 try:
@@ -13,11 +17,10 @@ except ImportError:
 
 # --- CONFIG ---
 st.set_page_config(page_title="SkyPay Agent Dashboard", page_icon="👩‍💻", layout="wide")
-st_autorefresh(interval=3000, key="agent_refresh")
 init_db()
 
-# --- CSS FOR CARDS AND UI ---
-st.markdown("""
+# --- CSS FOR CARDS AND UI (sent once per session) ---
+inject_css_once("agent_theme", """
     <style>
         /* Segmented Control Tabs */
         div[data-testid="stSegmentedControl"] {
@@ -65,7 +68,7 @@ st.markdown("""
             background-color: #f9fafb;
         }
     </style>
-""", unsafe_allow_html=True)
+""")
 
 def get_avatar(role):
     user_img = "assets/person.jpg"
@@ -75,20 +78,42 @@ def get_avatar(role):
     else:
         return skypay_img if os.path.exists(skypay_img) else "assistant"
 
-def format_timestamp(iso_str):
+def format_duration(total_seconds, count):
+    if not count:
+        return "—"
+    minutes = total_seconds / count / 60
+    return f"{minutes:.0f} min" if minutes < 120 else f"{minutes / 60:.1f} h"
+
+def format_rate(part, whole):
+    return f"{part / whole:.0%}" if whole else "—"
+
+def format_timestamp(value):
+    # Stored as UTC dates; shown in Philippine Time (UTC+8). Unmigrated strings are already PHT.
     try:
-        dt = datetime.fromisoformat(iso_str)
+        dt = value + timedelta(hours=8) if isinstance(value, datetime) else datetime.fromisoformat(value)
         return dt.strftime("%b %d, %Y - %I:%M %p")
     except:
-        return iso_str or "N/A"
+        return value or "N/A"
 
 st.title("👩‍💻 Agent Dashboard")
 
+PAGE_SIZE = 20
+
 if "selected_id" not in st.session_state:
     st.session_state.selected_id = None
+if "agent_id" not in st.session_state:
+    st.session_state.agent_id = f"agent-{uuid.uuid4().hex[:6]}"
+# Tickets this session has already claimed, so reruns don't re-issue the claim
+if "claimed" not in st.session_state:
+    st.session_state.claimed = set()
+
+# Replaces the 3s autorefresh: rerun only when the lists or the open ticket change
+rerun_on_change(LIST_KEY, *([st.session_state.selected_id] if st.session_state.selected_id else []))
+set_trace_tags()
 
 with st.sidebar:
     st.header("🔍 Ticket Explorer")
+    agent_name = st.text_input("Your name", key="agent_name", placeholder=st.session_state.agent_id).strip() or st.session_state.agent_id
     
     # Updated Status Toggle with new AI Tab
     mode = st.segmented_control(
@@ -109,28 +134,31 @@ with st.sidebar:
     else:
         search_query = st.text_input("Search Name, Email, or Ticket ID", key="ticket_search")
 
-    # Fetch data based on mode including the new AI Active pool
+    # Fetch one page based on mode; search and pagination run server-side
     if mode == "🤖 AI Active":
-        all_convos = get_ai_active_conversations()
+        group = "bot"
     elif mode == "🔥 Escalated":
-        all_convos = get_escalated_conversations()
+        group = "escalated"
     else:
-        all_convos = get_closed_conversations()
-    
-    # Filter Logic (Instant feedback)
-    filtered = []
-    if search_query:
-        q = search_query.lower()
-        for c in all_convos:
-            name_txt = (c[1] or "").lower()
-            tid_txt = (c[3] or "").lower()
-            email_txt = (c[4] or "").lower()
-            if q in name_txt or q in tid_txt or q in email_txt:
-                filtered.append(c)
-    else:
-        filtered = all_convos
+        group = "closed"
+
+    # Cursor stack for the current mode/search; reset whenever either changes
+    page_key = (group, search_query or "")
+    if st.session_state.get("page_key") != page_key:
+        st.session_state.page_key = page_key
+        st.session_state.page_cursors = [None]
+    cursors = st.session_state.page_cursors
+
+    filtered, next_cursor = search_conversations(group, search_query, after=cursors[-1], page_size=PAGE_SIZE)
 
-    st.caption(f"Showing {len(filtered)} {mode} tickets")
+    st.caption(f"Showing {len(filtered)} {mode} tickets (page {len(cursors)})")
+    prev_col, next_col = st.columns(2)
+    if prev_col.button("◀ Prev", key="page_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if next_col.button("Next ▶", key="page_next", disabled=next_cursor is None):
+        cursors.append(next_cursor)
+        st.rerun()
     st.divider()
 
     # --- TICKET LIST CARDS ---
@@ -151,6 +179,7 @@ with st.sidebar:
 # --- MAIN CHAT AREA ---
 if selected_data:
     s_id, s_name, s_concern, s_tid, s_email, s_created = selected_data
+    set_trace_tags(conversation_id=s_id, ticket_id=s_tid)
     
     st.subheader(f"💬 Ticket: {s_tid}")
     
@@ -165,13 +194,18 @@ if selected_data:
             st.write(f"**Topic:** {s_concern}")
             st.write(f"**Status:** {mode}")
 
-    # Set status to human_active ONLY if in Escalated mode
-    if mode == "🔥 Escalated": 
-        set_status(s_id, "human_active")
+    # Claim the ticket once per session; the write only happens on a real state change
+    owner = agent_name
+    if mode == "🔥 Escalated":
+        if s_id not in st.session_state.claimed and claim_ticket(s_id, agent_name):
+            st.session_state.claimed.add(s_id)
+        owner = get_assigned_agent(s_id) or agent_name
+        if owner != agent_name:
+            st.session_state.claimed.discard(s_id)
     
     # Message History
     st.write("---")
-    for r, c in get_messages(s_id):
+    for r, c in get_cached_messages(s_id):
         if r != "system":
             with st.chat_message(r, avatar=get_avatar(r)):
                 st.write(f"👩‍💻 (You): {c}" if r == "human" else c)
@@ -181,14 +215,21 @@ if selected_data:
         st.info("👀 You are currently shadowing an AI conversation.")
         # NEW Feature: Manual Takeover
         if st.button("🙋‍♂️ Take Over Chat", use_container_width=True, type="primary"):
-            set_status(s_id, "escalated")
-            add_message(s_id, "system", "Agent manually joined the conversation.")
+            record_status_change(s_id, "escalated", "Agent manually joined the conversation.")
+            st.rerun()
+
+    elif mode == "🔥 Escalated" and owner != agent_name:
+        st.warning(f"🔒 This ticket is being handled by **{owner}**.")
+        if st.button("🙋‍♂️ Take Over Ticket", use_container_width=True, type="primary"):
+            if reassign_ticket(s_id, owner, agent_name):
+                st.session_state.claimed.add(s_id)
+                add_system_message(s_id, f"Ticket reassigned from {owner} to {agent_name}.", buffered=True)
             st.rerun()
 
     elif mode == "🔥 Escalated":
         reply = st.chat_input("Type your response...")
         if reply:
-            add_message(s_id, "human", reply)
+            mark_own_writes(s_id, [add_message(s_id, "human", reply)])
             st.rerun()
             
         # Resolve Ticket Action Card
@@ -200,9 +241,82 @@ if selected_data:
         """, unsafe_allow_html=True)
         
         if st.button("✅ Confirm Resolution & Close", use_container_width=True, type="primary"):
-            close_conversation(s_id)
-            add_message(s_id, "system", "Agent closed this ticket.")
+            record_status_change(s_id, "closed", "Agent closed this ticket.")
             st.session_state.selected_id = None
             st.rerun()
 else:
-    st.info("### ⬅️ Select a ticket from the sidebar to begin assisting.")
+    queue_tab, metrics_tab = st.tabs(["🎫 Queue", "📊 Metrics"])
+
+    with queue_tab:
+        st.info("### ⬅️ Select a ticket from the sidebar to begin assisting.")
+
+        # --- ADMIN: PER-STAGE LATENCY (only computed while the toggle is on) ---
+        if st.toggle("📈 Show performance panel", key="show_perf"):
+            if not TRACER.enabled:
+                st.caption("Tracing is disabled (TRACING_ENABLED = false in secrets).")
+            else:
+                minutes = st.segmented_control("Window", [5, 15, 60], default=15, format_func=lambda m: f"Last {m} min", key="perf_window") or 15
+                spans = TRACER.recent(minutes * 60)
+                if not TRACER.export_dir:
+                    st.caption("Showing this process only. Set TRACE_EXPORT_DIR in secrets to include the customer chat processes.")
+                summary = stage_summary(spans)
+                if not summary:
+                    st.caption("No spans recorded in this window yet.")
+                else:
+                    st.dataframe(
+                        [{"stage": stage, "count": v["count"], "errors": v["errors"], "p50 ms": v["p50_ms"],
+                          "p95 ms": v["p95_ms"], "max ms": v["max_ms"]} for stage, v in summary.items()],
+                        hide_index=True, use_container_width=True
+                    )
+                    cache = cache_summary(spans)
+                    if cache["lookups"]:
+                        c1, c2, c3 = st.columns(3)
+                        c1.metric("Answer cache hit rate", format_rate(cache["hits"], cache["lookups"]))
+                        c2.metric("LLM time saved", f"{cache['latency_saved']:.1f}s")
+                        c3.metric("Cache evictions", cache["evictions"])
+                    col1, col2 = st.columns(2)
+                    col1.download_button("⬇️ Spans (JSON lines)", to_jsonl(spans), "spans.jsonl", use_container_width=True)
+                    col2.download_button("⬇️ Prometheus metrics", to_prometheus(summary), "stages.prom", use_container_width=True)
+
+    # --- SUPPORT METRICS (reads precomputed rollups only) ---
+    with metrics_tab:
+        days = st.segmented_control(
+            "Period", [1, 7, 30], default=7, key="metrics_days",
+            format_func=lambda d: "Today" if d == 1 else f"Last {d} days"
+        ) or 7
+        by_day, by_concern, queue_depth = get_support_metrics(days)
+        totals = {}
+        for counters in by_concern.values():
+            for key, value in counters.items():
+                totals[key] = totals.get(key, 0) + value
+
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Queue depth", sum(queue_depth.values()))
+        m2.metric("Escalation rate", format_rate(totals.get("escalated", 0), totals.get("started", 0)))
+        m3.metric("Avg. first human reply", format_duration(totals.get("first_reply_seconds", 0), totals.get("first_replies", 0)))
+        m4.metric("Avg. resolution time", format_duration(totals.get("resolution_seconds", 0), totals.get("resolved", 0)))
+
+        if not by_concern and not queue_depth:
+            st.caption("No metrics yet. Run `python migrate.py` once to load history.")
+        else:
+            st.markdown("#### By concern")
+            st.dataframe([
+                {
+                    "Concern": concern,
+                    "In queue": queue_depth.get(concern, 0),
+                    "Started": c.get("started", 0),
+                    "Escalated": c.get("escalated", 0),
+                    "Escalation rate": format_rate(c.get("escalated", 0), c.get("started", 0)),
+                    "Avg. first reply": format_duration(c.get("first_reply_seconds", 0), c.get("first_replies", 0)),
+                    "Closed": c.get("closed", 0),
+                    "Avg. resolution": format_duration(c.get("resolution_seconds", 0), c.get("resolved", 0)),
+                }
+                for concern, c in sorted(by_concern.items())
+            ], hide_index=True, use_container_width=True)
+            if by_day:
+                st.markdown("#### Per day")
+                st.bar_chart(
+                    [{"Day": day, "Started": c.get("started", 0), "Escalated": c.get("escalated", 0), "Closed": c.get("closed", 0)}
+                     for day, c in sorted(by_day.items())],
+                    x="Day", y=["Started", "Escalated", "Closed"], stack=False
+                )
@@ -1,13 +1,13 @@
 import streamlit as st
-from groq import Groq
+from llm import get_llm
 from database import get_messages, add_message, get_conversation_status, create_conversation
 
 st.set_page_config(page_title="Skypay Support", page_icon="🤖")
 st.title("🤖 Skypay Support Chat")
 
-# Initialize Groq Client
+# Shared LLM gateway (one Groq client per process)
 try:
-    client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+    llm = get_llm()
 except Exception as e:
     st.error("Groq API Key missing in secrets.")
     st.stop()
@@ -63,13 +63,7 @@ Rules:
                     full_history.append({"role": "user", "content": user_input})
 
                     # Call Groq API
-                    completion = client.chat.completions.create(
-                        model="llama-3.1-8b-instant",
-                        messages=full_history,
-                        temperature=0.5,
-                        max_tokens=300
-                    )
-                    reply = completion.choices[0].message.content
+                    reply = llm.complete(full_history, temperature=0.5, max_tokens=300)
                     
                     st.write(reply)
                     add_message(conversation_id, "ai", reply) 
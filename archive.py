@@ -0,0 +1,11 @@
+# Archives closed conversations older than ARCHIVE_AFTER_DAYS (secrets, default 30).
+# Usage: python archive.py   (e.g. nightly from cron; reads .streamlit/secrets.toml)
+from datetime import timedelta
+from database import init_db, archive_closed_conversations, ARCHIVE_AFTER
+from settings import get_secret
+
+if __name__ == "__main__":
+    init_db()
+    days = get_secret("ARCHIVE_AFTER_DAYS")
+    older_than = timedelta(days=float(days)) if days is not None else ARCHIVE_AFTER
+    print(f"Archived {archive_closed_conversations(older_than)} conversations")
@@ -0,0 +1,77 @@
+import os
+import re
+import json
+import base64
+import hashlib
+import streamlit as st
+
+# Files here are served by Streamlit at app/static/... (server.enableStaticServing)
+STATIC_DIR = "static"
+
+# =========================
+# Encoded Assets
+# =========================
+@st.cache_data(max_entries=32)
+def _encode_file(path, mtime):
+    with open(path, 'rb') as f:
+        data = f.read()
+    return base64.b64encode(data).decode()
+
+def get_base64_of_bin_file(bin_file):
+    # Encoded once per process; the mtime in the cache key picks up edited files
+    return _encode_file(bin_file, os.path.getmtime(bin_file))
+
+def asset_url(path):
+    # Static files are fetched (and cached) by the browser instead of inlined as data URIs
+    rel = os.path.relpath(path, STATIC_DIR)
+    if not rel.startswith(".."):
+        return f"app/static/{rel.replace(os.sep, '/')}"
+    ext = os.path.splitext(path)[1].lstrip(".") or "png"
+    return f"data:image/{ext};base64,{get_base64_of_bin_file(path)}"
+
+# =========================
+# CSS Injection
+# =========================
+def inject_css_once(key, css):
+    """Add a stylesheet to the page head once per session instead of on every rerun.
+
+    The style tag lives in the parent document, so it survives reruns even
+    though the script-only iframe that injected it is not re-emitted. st.iframe
+    embeds HTML strings same-origin, which is what lets the script reach it;
+    its "content" height measures to zero for a document with nothing to show.
+    """
+    css = re.sub(r"</?style>", "", css)
+    digest = hashlib.sha1(css.encode("utf-8")).hexdigest()[:12]
+    flag = f"_css_{key}"
+    if st.session_state.get(flag) == digest:
+        return
+    st.session_state[flag] = digest
+    st.iframe(f"""
+        <script>
+        const doc = window.parent.document;
+        let el = doc.getElementById("css-{key}");
+        if (!el) {{
+            el = doc.createElement("style");
+            el.id = "css-{key}";
+            doc.head.appendChild(el);
+        }}
+        el.textContent = {json.dumps(css)};
+        </script>
+    """, height="content")
+
+def set_bg_img(png_file):
+    if os.path.exists(png_file):
+        inject_css_once("background", f'''
+        .stApp {{
+            background-image: url("{asset_url(png_file)}");
+            background-size: 100% 100%;
+            background-repeat: no-repeat;
+            background-attachment: fixed;
+            background-position: center;
+        }}
+
+        /* Overlay to ensure readability */
+        .stAppHost {{
+            background-color: rgba(255, 255, 255, 0.5) !important;
+        }}
+        ''')
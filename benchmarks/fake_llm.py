@@ -0,0 +1,112 @@
+"""Groq/OpenAI-compatible chat completions server with configurable latency.
+
+Point the apps at it with LLM_BASE_URL = "http://127.0.0.1:8900" in secrets.
+Usage: python benchmarks/fake_llm.py [--port 8900] [--ttft 0.4] [--token-delay 0.02] [--tokens 40]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = "/openai/v1/chat/completions"
+WORDS = "SkyPay routes payments between merchants lenders and partner channels for collections and payouts".split()
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, ttft=0.4, token_delay=0.02, tokens=40, error_rate=0.0):
+        super().__init__(address, _Handler)
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != COMPLETIONS_PATH:
+            return self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+        server = self.server
+        server.count("requests")
+        if random.random() < server.error_rate:
+            server.count("errors")
+            return self._json(429, {"error": {"message": "Rate limit reached"}}, {"Retry-After": "1"})
+        model = body.get("model", "fake")
+        words = [random.choice(WORDS) for _ in range(min(server.tokens, body.get("max_tokens") or server.tokens))]
+        time.sleep(server.ttft)
+        if body.get("stream"):
+            server.count("streamed")
+            return self._stream(model, words)
+        time.sleep(server.token_delay * len(words))
+        self._json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+        })
+
+    def _json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, model, words):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        created = int(time.time())
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": (" " if i else "") + word}, "finish_reason": None}],
+            }
+            self._chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def serve(host="127.0.0.1", port=0, **latency):
+    # port=0 picks a free port; the bound port is server.server_address[1]
+    server = FakeLLMServer((host, port), **latency)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.4)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLLMServer(("127.0.0.1", args.port), args.ttft, args.token_delay, args.tokens, args.error_rate)
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,434 @@
+"""Load test: simulated customers and agents against the real database and chat code paths.
+
+Usage (from the repo root):
+    python benchmarks/load.py [--customers 200] [--agents 10] [--mongo-uri mongodb://localhost:27017]
+
+Each customer onboards, clicks an FAQ, asks free-text questions and may
+escalate; each agent lists escalated tickets, claims one, replies and closes
+it. Sessions call database.py and chat.py (bot.py's retrieval / cache /
+history / LLM pipeline) the way bot.py and app_agent.py do. Streamlit
+rendering is not included.
+
+Without --mongo-uri the run uses mongomock. The LLM is a local fake
+Groq-compatible server and email goes to a local SMTP sink. Results (p50/p95/p99
+per interaction, Mongo ops per interaction, throughput) are printed and saved
+as JSON under benchmarks/results/.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import pymongo
+from pymongo import monitoring
+from streamlit import config
+
+import fake_llm
+import smtp_sink
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+QUESTIONS_FILE = os.path.join(ROOT, "benchmarks", "retrieval_queries.json")
+OFF_TOPIC_QUESTIONS = ["What is the capital of France?", "Can you write me a poem?", "What's the weather today?"]
+
+# =========================
+# Mongo Op Counting
+# =========================
+class OpCounter:
+    """Counts Mongo operations per thread, so each interaction sees only its own ops."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.background = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        return getattr(self.local, "ops", None)
+
+    def count(self):
+        if self.current() is not None:
+            self.local.ops += 1
+        else:
+            with self._lock:
+                self.background += 1
+
+class _CommandCounter(monitoring.CommandListener):
+    def __init__(self, counter):
+        self.counter = counter
+
+    def started(self, event):
+        self.counter.count()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+MOCK_OPS = [
+    "find", "find_one", "find_one_and_update", "insert_one", "insert_many", "update_one", "update_many",
+    "delete_one", "delete_many", "aggregate", "bulk_write", "count_documents", "distinct", "replace_one",
+]
+
+def use_mongomock(counter):
+    # mongomock emits no command events, so count its public collection methods instead
+    import mongomock
+    from mongomock.collection import Collection
+    depth = threading.local()
+
+    def counted(method):
+        def wrapper(*args, **kwargs):
+            depth.n = getattr(depth, "n", 0) + 1
+            try:
+                if depth.n == 1:
+                    counter.count()
+                return method(*args, **kwargs)
+            finally:
+                depth.n -= 1
+        return wrapper
+
+    for name in MOCK_OPS:
+        setattr(Collection, name, counted(getattr(Collection, name)))
+    pymongo.MongoClient = mongomock.MongoClient
+
+# =========================
+# Environment
+# =========================
+def write_secrets(mongo_uri, llm_port, smtp_port, llm_concurrency):
+    secrets = {
+        "MONGO_URI": mongo_uri,
+        "GROQ_API_KEY": "load-test",
+        "LLM_BASE_URL": f"http://127.0.0.1:{llm_port}",
+        "LLM_MAX_CONCURRENCY": llm_concurrency,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": smtp_port,
+        "SMTP_STARTTLS": False,
+        "EMAIL_USER": "support@example.com",
+        "EMAIL_PASS": "",
+        "ESCALATION_RECIPIENT": "agents@example.com",
+        # LLM latency is summarized from the tracer's spans, so keep every span of the run
+        "TRACE_BUFFER_SIZE": 1000000,
+    }
+    f = tempfile.NamedTemporaryFile("w", suffix=".toml", delete=False, encoding="utf-8")
+    for key, value in secrets.items():
+        f.write(f"{key} = {json.dumps(value)}\n")
+    f.close()
+    config.set_option("secrets.files", [f.name])
+    return f.name
+
+def quiet_streamlit():
+    # Bare-mode calls to cached functions log a warning each; they are expected here
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+# =========================
+# Simulation
+# =========================
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def measure(self, name, fn, *args):
+        self.counter.local.ops = 0
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.errors.setdefault(name, []).append(repr(e))
+            return None
+        finally:
+            elapsed = time.perf_counter() - start
+            ops, self.counter.local.ops = self.counter.local.ops, None
+            with self._lock:
+                self.samples.setdefault(name, []).append((elapsed, ops))
+
+    def report(self):
+        # Imported here like Env's imports: repo modules read secrets, which must be written first
+        from tracing import percentile
+        out = {}
+        for name, samples in sorted(self.samples.items()):
+            ms = [s[0] * 1000 for s in samples]
+            ops = [s[1] for s in samples]
+            out[name] = {
+                "count": len(samples),
+                "errors": len(self.errors.get(name, [])),
+                "p50_ms": round(percentile(ms, 50), 2),
+                "p95_ms": round(percentile(ms, 95), 2),
+                "p99_ms": round(percentile(ms, 99), 2),
+                "mean_ms": round(sum(ms) / len(ms), 2),
+                "mongo_ops_mean": round(sum(ops) / len(ops), 2),
+                "mongo_ops_max": max(ops),
+            }
+        return out
+
+class CustomerSession:
+    """One bot.py session: the same calls bot.py makes, with its own transcript cache."""
+
+    def __init__(self, n, env, args, rng):
+        self.n = n
+        self.env = env
+        self.args = args
+        self.rng = rng
+        self.cid = None
+        self.meta = None
+        self.cache = {"cursor": None, "ids": set(), "messages": []}
+        self.history_state = {}
+
+    def messages(self):
+        return [(role, content) for _, _, _, role, content in self.cache["messages"]]
+
+    def refresh(self):
+        # What each rerun does: metadata plus new messages in one round trip
+        self.meta, docs = self.env.db.get_conversation_view(self.cid, self.cache["cursor"])
+        self.env.db._merge_messages(self.cache, docs)
+
+    def write_turn(self, turn):
+        for msg in self.env.db.add_messages(self.cid, turn):
+            self.env.db._merge_messages(self.cache, [(msg["_id"], msg.get("seq"), msg["role"], msg["content"])])
+
+    def onboard(self):
+        name, email = f"Load Customer {self.n}", f"customer{self.n}@example.com"
+        self.cid = self.env.db.create_conversation(name, self.rng.choice(["Inquiries", "Partnerships", "Others"]), email)
+        self.env.db.add_system_message(self.cid, f"User: {name}, Email: {email}", buffered=True)
+        self.refresh()
+
+    def faq_click(self):
+        question = self.rng.choice(list(self.env.presets))
+        self.write_turn([("user", question), ("ai", self.env.presets[question])])
+
+    def ask(self, prompt):
+        # Same branches as bot.py: preset, cached answer, or save the question then stream the answer
+        env = self.env
+        turn = [("user", prompt)]
+        preset = env.chat.find_preset(prompt)
+        chat = None if preset else env.chat.ChatTurn(prompt, self.messages(), env.llm, env.answer_cache, self.history_state)
+        if preset or chat.cached:
+            turn.append(("ai", preset or chat.cached))
+        else:
+            self.write_turn(turn)
+            reply = "".join(chat.stream())
+            turn = [("ai", reply)]
+            chat.finish(reply)
+        self.write_turn(turn)
+        self.refresh()
+
+    def escalate(self):
+        db = self.env.db
+        _, user_name, concern, ticket_id, user_email = self.meta
+        db.record_status_change(self.cid, "escalated", "User requested human agent. Support notified.")
+        db.queue_escalation_email(ticket_id, user_name, user_email, concern)
+        self.env.outbox_worker.wake()
+        self.refresh()
+
+    def run(self, rec):
+        args = self.args
+        time.sleep(self.rng.uniform(0, args.ramp))
+        rec.measure("onboarding", self.onboard)
+        if self.cid is None:
+            return
+        self.think()
+        rec.measure("faq_click", self.faq_click)
+        for _ in range(args.questions):
+            self.think()
+            pool = OFF_TOPIC_QUESTIONS if self.rng.random() < 0.1 else self.env.questions
+            rec.measure("question", self.ask, self.rng.choice(pool))
+        if self.rng.random() < args.escalation_rate:
+            self.think()
+            rec.measure("escalation", self.escalate)
+
+    def think(self):
+        time.sleep(self.rng.uniform(0.5, 1.5) * self.args.think)
+
+class AgentSession:
+    """One app_agent.py session working the escalated queue."""
+
+    def __init__(self, n, env, args, rng):
+        self.name = f"agent-{n}"
+        self.env = env
+        self.args = args
+        self.rng = rng
+        self.handled = 0
+
+    def list_queue(self):
+        rows, _ = self.env.db.search_conversations("escalated", page_size=20)
+        return rows
+
+    def open_ticket(self, rows):
+        db = self.env.db
+        for row in rows:
+            if db.claim_ticket(row[0], self.name):
+                db.get_messages_since(row[0])
+                return row[0]
+        return None
+
+    def reply(self, cid):
+        self.env.db.add_message(cid, "human", f"Hi, this is {self.name}. Let me check that for you.")
+        self.env.db.get_messages_since(cid)
+
+    def close(self, cid):
+        self.env.db.record_status_change(cid, "closed", "Agent closed this ticket.")
+
+    def run(self, rec, customers_done):
+        while True:
+            rows = rec.measure("agent_list", self.list_queue) or []
+            if not rows and customers_done.is_set():
+                return
+            cid = rec.measure("agent_open", self.open_ticket, rows) if rows else None
+            if cid:
+                time.sleep(self.rng.uniform(0.5, 1.5) * self.args.think)
+                rec.measure("agent_reply", self.reply, cid)
+                rec.measure("agent_close", self.close, cid)
+                self.handled += 1
+            else:
+                time.sleep(self.args.agent_poll)
+
+class Env:
+    def __init__(self):
+        import chat
+        import database
+        from prompts import PRESET_ANSWERS
+        from knowledge_base import get_knowledge_base
+        from answer_cache import get_answer_cache
+        from llm import get_llm
+        from mailer import get_outbox_worker
+        from notifications import get_notifier
+
+        self.db = database
+        database.init_db()
+        self.chat = chat
+        self.presets = PRESET_ANSWERS
+        # Loaded up front, as bot.py's first question would
+        self.kb = get_knowledge_base()
+        self.answer_cache = get_answer_cache(PRESET_ANSWERS)
+        self.llm = get_llm()
+        self.outbox_worker = get_outbox_worker()
+        # The dashboards' change watcher runs in every app process, so its polling is part of the load
+        self.notifier = get_notifier()
+        with open(QUESTIONS_FILE, "r", encoding="utf-8") as f:
+            self.questions = [q["query"] for q in json.load(f)]
+
+def llm_latency(since):
+    # llm.ttft / llm.stream / llm.complete spans recorded during the run, as the dashboard summarizes them
+    from tracing import TRACER, stage_summary
+    return stage_summary([s for s in list(TRACER.spans) if s["ts"] >= since and s["stage"].startswith("llm.")])
+
+def wait_for_outbox(env, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not env.db.get_db().outbox.count_documents({"status": {"$in": ["pending", "sending"]}}):
+            return True
+        env.outbox_worker.wake()
+        time.sleep(0.5)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--agents", type=int, default=10)
+    parser.add_argument("--questions", type=int, default=2, help="free-text questions per customer")
+    parser.add_argument("--escalation-rate", type=float, default=0.3)
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between customer actions (s)")
+    parser.add_argument("--ramp", type=float, default=10.0, help="customers start spread over this many seconds")
+    parser.add_argument("--agent-poll", type=float, default=1.0)
+    parser.add_argument("--mongo-uri", help="local mongod to test against (default: mongomock)")
+    parser.add_argument("--llm-ttft", type=float, default=0.4)
+    parser.add_argument("--llm-token-delay", type=float, default=0.02)
+    parser.add_argument("--llm-tokens", type=int, default=40)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/load-<time>.json)")
+    args = parser.parse_args()
+
+    counter = OpCounter()
+    if args.mongo_uri:
+        monitoring.register(_CommandCounter(counter))
+        mongo_uri = args.mongo_uri
+    else:
+        use_mongomock(counter)
+        mongo_uri = "mongodb://localhost:27017"
+    llm_server = fake_llm.serve(ttft=args.llm_ttft, token_delay=args.llm_token_delay,
+                                tokens=args.llm_tokens, error_rate=args.llm_error_rate)
+    sink = smtp_sink.serve()
+    secrets_file = write_secrets(mongo_uri, llm_server.server_address[1], sink.server_address[1], args.llm_concurrency)
+    quiet_streamlit()
+
+    try:
+        env = Env()
+        quiet_streamlit()
+        rec = Recorder(counter)
+        rng = random.Random(args.seed)
+        customers = [CustomerSession(i, env, args, random.Random(rng.random())) for i in range(args.customers)]
+        agents = [AgentSession(i, env, args, random.Random(rng.random())) for i in range(args.agents)]
+        customers_done = threading.Event()
+
+        start = time.perf_counter()
+        started_at = time.time()
+        background_start = counter.background
+        customer_threads = [threading.Thread(target=c.run, args=(rec,)) for c in customers]
+        agent_threads = [threading.Thread(target=a.run, args=(rec, customers_done)) for a in agents]
+        for t in customer_threads + agent_threads:
+            t.start()
+        for t in customer_threads:
+            t.join()
+        customers_done.set()
+        for t in agent_threads:
+            t.join()
+        env.db.get_audit_buffer().flush()
+        delivered = wait_for_outbox(env, 60)
+        elapsed = time.perf_counter() - start
+
+        interactions = rec.report()
+        total = sum(v["count"] for v in interactions.values())
+        results = {
+            "run_at": datetime.utcnow().isoformat() + "Z",
+            "config": vars(args),
+            "backend": "mongod" if args.mongo_uri else "mongomock",
+            "duration_s": round(elapsed, 2),
+            "throughput": {
+                "interactions_per_s": round(total / elapsed, 2),
+                "questions_per_s": round(interactions.get("question", {}).get("count", 0) / elapsed, 2),
+                "tickets_closed": sum(a.handled for a in agents),
+            },
+            "interactions": interactions,
+            "mongo_ops": {
+                "interactions": round(sum(v["mongo_ops_mean"] * v["count"] for v in interactions.values())),
+                "background": counter.background - background_start,
+            },
+            "llm": {"gateway": env.llm.summary(), "server": dict(llm_server.stats), "latency": llm_latency(started_at)},
+            "answer_cache": env.answer_cache.summary(),
+            "email": {"delivered": sink.stats["messages"], "smtp_connections": sink.stats["connections"],
+                      "outbox_drained": delivered, "worker": dict(env.outbox_worker.stats)},
+            "errors": {name: errs[:5] for name, errs in rec.errors.items()},
+        }
+    finally:
+        os.remove(secrets_file)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, default=str)
+
+    print(f"{args.customers} customers, {args.agents} agents, {results['duration_s']}s "
+          f"({results['throughput']['interactions_per_s']} interactions/s)")
+    print(f"{'interaction':<14}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops':>7}")
+    for name, v in interactions.items():
+        print(f"{name:<14}{v['count']:>7}{v['errors']:>5}{v['p50_ms']:>10}{v['p95_ms']:>10}{v['p99_ms']:>10}{v['mongo_ops_mean']:>7}")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare knowledge retrieval backends on a labeled query set.
+
+Usage (from the repo root):
+    python benchmarks/retrieval.py [--k 3] [--distractors 5000] [--repeat 5]
+
+A query counts as recalled when any of its expected snippets appears in one
+of the top-k lines. --distractors pads the knowledge base with synthetic lines
+built from its own vocabulary, to see how each backend scales.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from knowledge_base import KNOWLEDGE_FILE, KnowledgeBase, tokenize
+from tracing import percentile
+
+QUERIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_queries.json")
+
+def build_knowledge_file(distractors, seed=0):
+    with open(KNOWLEDGE_FILE, "r", encoding="utf-8") as f:
+        text = f.read()
+    if not distractors:
+        return KNOWLEDGE_FILE
+    rng = random.Random(seed)
+    vocab = sorted({t for line in text.splitlines() for t in tokenize(line)})
+    filler = [" ".join(rng.choice(vocab) for _ in range(rng.randint(8, 25))) for _ in range(distractors)]
+    f = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8")
+    f.write(text + "\n" + "\n".join(filler) + "\n")
+    f.close()
+    return f.name
+
+def run(backend, path, queries, k, repeat):
+    start = time.perf_counter()
+    kb = KnowledgeBase(path, backend=backend)
+    load = time.perf_counter() - start
+    latencies, hits = [], 0
+    for item in queries:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = kb.search(item["query"], limit=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        if any(snippet.lower() in line.lower() for line in results for snippet in item["expected"]):
+            hits += 1
+    return {
+        "backend": backend,
+        "lines": len(kb.snapshot.lines),
+        "load_ms": round(load * 1000, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        f"recall@{k}": round(hits / len(queries), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--distractors", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--queries", default=QUERIES_FILE)
+    args = parser.parse_args()
+
+    with open(args.queries, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    path = build_knowledge_file(args.distractors)
+    try:
+        for backend in ("fuzzy", "bm25"):
+            print(json.dumps(run(backend, path, queries, args.k, args.repeat)))
+    finally:
+        if path != KNOWLEDGE_FILE:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
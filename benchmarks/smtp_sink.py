@@ -0,0 +1,63 @@
+"""Minimal SMTP server that accepts and counts every message (no TLS, no auth).
+
+Use with SMTP_HOST = "127.0.0.1", SMTP_PORT = 2525, SMTP_STARTTLS = false, EMAIL_PASS = "".
+Usage: python benchmarks/smtp_sink.py [--port 2525]
+"""
+import argparse
+import socketserver
+import threading
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _Handler)
+        self.stats = {"connections": 0, "messages": 0}
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.count("connections")
+        self.reply("220 sink ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250-sink")
+                self.reply("250 8BITMIME")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.server.count("messages")
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply("250 OK")
+
+def serve(host="127.0.0.1", port=0):
+    # port=0 picks a free port; the bound port is server.server_address[1]
+    server = SMTPSink((host, port))
+    threading.Thread(target=server.serve_forever, name="smtp-sink", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=2525)
+    args = parser.parse_args()
+    server = SMTPSink(("127.0.0.1", args.port))
+    print(f"SMTP sink listening on 127.0.0.1:{args.port}")
+    server.serve_forever()
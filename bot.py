@@ -1,41 +1,17 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 import os
 import re
 import time
-import base64
-from thefuzz import process, fuzz 
-from groq import Groq 
+import html
 from database import *
-
-# =========================
-# Helper for Background Image
-# =========================
-def get_base64_of_bin_file(bin_file):
-    with open(bin_file, 'rb') as f:
-        data = f.read()
-    return base64.b64encode(data).decode()
-
-def set_bg_img(png_file):
-    if os.path.exists(png_file):
-        bin_str = get_base64_of_bin_file(png_file)
-        page_bg_img = f'''
-        <style>
-        .stApp {{
-            background-image: url("data:image/jpg;base64,{bin_str}");
-            background-size: 100% 100%;
-            background-repeat: no-repeat;
-            background-attachment: fixed;
-            background-position: center;
-        }}
-        
-        /* Overlay to ensure readability */
-        .stAppHost {{
-            background-color: rgba(255, 255, 255, 0.5) !important;
-        }}
-        </style>
-        '''
-        st.markdown(page_bg_img, unsafe_allow_html=True)
+from llm import get_llm, LLMUnavailableError
+from prompts import OFF_TOPIC, UNSURE, PRESET_ANSWERS
+from answer_cache import get_answer_cache
+from chat import ChatTurn, find_preset
+from notifications import mark_own_writes, rerun_on_change
+from mailer import get_outbox_worker
+from assets import inject_css_once, set_bg_img
+from tracing import TRACER, set_trace_tags
 
 # =========================
 # Hide Streamlit Branding
@@ -53,29 +29,30 @@ hide_st_style = """
             }
             </style>
             """
-st.markdown(hide_st_style, unsafe_allow_html=True)
+inject_css_once("hide_st", hide_st_style)
 
 # =========================
 # Page Configuration
 # =========================
 st.set_page_config(page_title="Skypay Support Bot", page_icon="🤖", layout="wide")
-st_autorefresh(interval=3000)
 
 # Set Background Image
-#set_bg_img('assets/bg.jpg')
+#set_bg_img('static/bg.jpg')
 
 # Initialize DB
 init_db()
+# Background delivery of escalation emails (one worker per process)
+outbox_worker = get_outbox_worker()
 
-# Initialize Groq Client
+# Shared LLM gateway (one Groq client per process)
 try:
-    client = Groq(api_key=st.secrets["GROQ_API_KEY"])
+    llm = get_llm()
 except Exception as e:
     st.error("🚨 Groq API Key is missing. Please check .streamlit/secrets.toml")
     st.stop()
 
-# CSS for UI Styling
-st.markdown(f"""
+# CSS for UI Styling (sent once per session)
+inject_css_once("bot_theme", f"""
     <style>
         :root {{
             --background-color: #ffffff;
@@ -162,6 +139,16 @@ st.markdown(f"""
             font-weight: 600;
         }}
 
+        /* Client-side typing reveal for instant preset answers */
+        .typing-reveal {{
+            animation: typing-reveal 0.8s steps(40, end) both;
+        }}
+
+        @keyframes typing-reveal {{
+            from {{ clip-path: inset(0 100% 0 0); }}
+            to {{ clip-path: inset(0 0 0 0); }}
+        }}
+
         .resolved-card-container {{
             background-color: rgba(255, 255, 255, 0.95);
             border: 2px solid #28a745;
@@ -184,7 +171,7 @@ st.markdown(f"""
             color: #ffffff !important;
         }}
     </style>
-""", unsafe_allow_html=True)
+""")
 
 # =========================
 # Helper Functions
@@ -204,34 +191,36 @@ def get_avatar(role):
 # =========================
 # CONSTANTS & PRESETS
 # =========================
-OFF_TOPIC = "I'm sorry, but I can only answer inquiries regarding SkyPay services. I cannot assist with general knowledge questions."
-UNSURE = "I'm not sure about that yet, but I can help escalate it."
-
-PRESET_ANSWERS = {
-    "What is SkyPay?": "Established in August 2018, Skybridge Payment, Inc. (SKYPAY) is a Philippines-based fintech company specializing in payment gateway services. We are a BSP-licensed Operator of Payment System (OPS) and SEC-registered firm providing B2B payment infrastructure for merchants, lenders, and partners.",
-    "Is SkyPay a scam?": "No, SKYPAY is a legitimate SEC-registered and BSP-licensed fintech firm. Only accredited partners like 7-Eleven, GCash, or Maya are authorized to collect on our behalf. Do not entertain unauthorized persons instructing you to settle payments to personal accounts.",
-    "What are SkyPay office hours?": "Our office hours are Monday to Friday, 9:00 AM to 6:00 PM Philippine Time. We are closed on weekends and holidays.",
-    "What are SkyPay's services?": "We offer OTC and digital collection/disbursement solutions, cash payouts, and bill payments for over 200 partners. Value-added services include Buy Load, Top Up, and Cash In.",
-    "How do I contact SkyPay support?": "Reach us via email at cs@skypay.ph, landline at +63 5328 5320, or mobile at +63 927 558 0175 (Globe) and +63 999 590 3042 (Smart).",
-    "Is SkyPay a loaning company?": "No, SKYPAY is NOT a loaning or lending company. We act solely as a technology bridge; any money received for loans originates from third-party lenders who use our routing system."
-}
-
-def get_fuzzy_context(query):
-    try:
-        if not os.path.exists("knowledge.txt"): return ""
-        with open("knowledge.txt", "r", encoding="utf-8") as f:
-            lines = [l.strip() for l in f.readlines() if len(l.strip()) > 10]
-        matches = process.extract(query, lines, scorer=fuzz.token_set_ratio, limit=3)
-        return "\n".join([m[0] for m in matches if m[1] > 60])
-    except: return ""
+# Render AI replies token-by-token instead of waiting for the full completion
+STREAM_RESPONSES = True
+# Animate preset answers in the browser; the script thread never waits
+PRESET_TYPING_EFFECT = True
+
+# Reuses answers for preset variants and repeated questions with the same retrieved context
+answer_cache = get_answer_cache(PRESET_ANSWERS)
+
+def save_turn(messages):
+    written = add_messages(cid, messages)
+    for msg in written:
+        cache_message(msg)
+    # The preset path doesn't rerun, so this session's own write must not trigger one via the notifier
+    mark_own_writes(cid, written)
 
 # =========================
 # Session Setup
 # =========================
-if "conversation_id" not in st.session_state:
-    st.session_state.conversation_id = create_conversation()
-cid = st.session_state.conversation_id
-status, user_name, concern, ticket_id, user_email = get_conversation_data(cid)
+# Nothing is written to Mongo until onboarding is submitted
+cid = st.session_state.get("conversation_id")
+if cid:
+    set_trace_tags(conversation_id=cid)
+    # Replaces the 3s autorefresh: rerun only when this conversation changes
+    rerun_on_change(cid)
+    # Metadata and any new messages in one round trip
+    status, user_name, concern, ticket_id, user_email = get_cached_conversation(cid)
+    set_trace_tags(conversation_id=cid, ticket_id=ticket_id)
+else:
+    set_trace_tags()
+    status = "onboarding"
 
 # =========================
 # ONBOARDING FLOW
@@ -246,8 +235,9 @@ if status == 'onboarding':
             if not name.strip() or not email_input.strip() or not is_valid_email(email_input):
                 st.error("Please provide a valid name and email.")
             else:
-                update_onboarding(cid, name, topic, email_input)
-                add_message(cid, "system", f"User: {name}, Email: {email_input}")
+                cid = create_conversation(name, topic, email_input)
+                st.session_state.conversation_id = cid
+                add_system_message(cid, f"User: {name}, Email: {email_input}", buffered=True)
                 st.rerun()
     st.stop()
 
@@ -278,7 +268,7 @@ if not human_active and not is_closed:
     for i, q in enumerate(list(PRESET_ANSWERS.keys())):
         if cols[i % 3].button(q): st.session_state.curr_prompt = q
 
-db_msgs = get_messages(cid)
+db_msgs = get_cached_messages(cid, refresh=False)
 show_esc = False
 
 for r, c in db_msgs:
@@ -286,6 +276,12 @@ for r, c in db_msgs:
         with st.chat_message(r, avatar=get_avatar(r)):
             st.write(f"👩‍💻 {c}" if r == "human" else c)
 
+# A failed answer is reported after the rerun that follows it, so the rerun doesn't erase it
+llm_notice = st.session_state.pop("llm_notice", None)
+if llm_notice:
+    kind, text = llm_notice
+    st.warning(text) if kind == "warning" else st.error(text)
+
 if db_msgs:
     last_role, last_content = db_msgs[-1]
     if last_role == "ai":
@@ -329,66 +325,63 @@ else:
     prompt = st.session_state.get("curr_prompt") or u_input
 
     if prompt:
+        turn_started = time.perf_counter()
+        chat = None
         if "curr_prompt" in st.session_state: del st.session_state["curr_prompt"]
-        add_message(cid, "user", prompt)
+        preset = None if human_active else find_preset(prompt)
+        # The user message and its answer are written together in one insert; the LLM path
+        # saves the question before streaming so shadowing agents see it straight away
+        turn = [("user", prompt)]
         
-        if not human_active:
-            if prompt in PRESET_ANSWERS:
-                with st.spinner("Skypay AI is thinking..."):
-                    time.sleep(1)
-                    add_message(cid, "ai", PRESET_ANSWERS[prompt])
-            else:
-                history = get_messages(cid)
-                ctx = get_fuzzy_context(prompt)
-                
-                with st.spinner("Skypay AI is working on your answer..."):
-                    try:
-                        # STRICT RULES TO PREVENT CITATION TAGS
-                        sys_p = (
-                            f"You are a strict customer support agent for SkyPay. "
-                            f"Your ONLY purpose is to answer questions about SkyPay services. "
-                            f"Context: {ctx}. "
-                            f"IMPORTANT RULES:\n"
-                            f"1. Do NOT include citation markers like or .\n"
-                            f"2. Use context naturally without referring to it by name.\n"
-                            f"3. If unrelated, reply: '{OFF_TOPIC}'\n"
-                            f"4. If unsure, reply: '{UNSURE}'"
-                            f"You are a strict SkyPay Support Agent. Use ONLY the provided context: {ctx}.\n"
-    "STRICT CONSTRAINTS:\n"
-    "1. SkyPay is B2B infrastructure. There is NO user dashboard, NO login page, and NO mobile app for customers.\n"
-    "2. If an answer is not in the context, you MUST use the UNSURE phrase. Do not invent steps.\n"
-    "3. Do not offer technical troubleshooting (like 'clear your cache') unless it is in the context.\n"
-    f"4. If unrelated, reply: '{OFF_TOPIC}'\n"
-    f"You are a strict customer support agent for SkyPay. "
-    f"Your ONLY purpose is to answer questions about SkyPay services based on the provided context. "
-    f"Context: {ctx}. "
-    f"STRICT PRIVACY & SECURITY RULES:\n"
-    f"1. NEVER ask the user for their GCash number, bank account, password, or OTP.\n"
-    f"2. NEVER claim to 'check the system' or 'look up an account.' You do not have access to live user data.\n"
-    f"3. NEVER tell a user you have 'found' their account or transactions.\n"
-    f"4. If a user has a specific transaction issue, instruct them to contact cs@skypay.ph or escalate to a human agent.\n"
-    f"5. If unrelated to SkyPay, reply: '{OFF_TOPIC}'\n"
-    f"6. If the answer isn't in the context, reply: '{UNSURE}'\n"
-    f"7. Do NOT include citation markers like [1] or [source].\n"
-    f"8. SkyPay is B2B infrastructure. There is NO user dashboard or mobile app for customers."
-                        )
-                        msgs = [{"role": "system", "content": sys_p}]
-                        for r, c in history:
-                            if r in ["user", "ai", "human"]:
-                                role_map = "assistant" if r in ["ai", "human"] else "user"
-                                msgs.append({"role": role_map, "content": c})
-                        
-                        completion = client.chat.completions.create(
-                            model="llama-3.1-8b-instant", 
-                            messages=msgs,
-                            temperature=0.1, 
-                            max_tokens=500
-                        )
-                        reply = completion.choices[0].message.content
-                        add_message(cid, "ai", reply)
-                    except Exception as e:
-                        st.error(f"Error calling Groq API: {e}")
-        st.rerun()
+        try:
+            if not human_active:
+                if preset:
+                    # Fast path: render in place instead of sleeping and forcing another rerun
+                    with st.chat_message("user", avatar=get_avatar("user")):
+                        st.write(prompt)
+                    with st.chat_message("ai", avatar=get_avatar("ai")):
+                        if PRESET_TYPING_EFFECT:
+                            st.markdown(f'<div class="typing-reveal">{html.escape(preset)}</div>', unsafe_allow_html=True)
+                        else:
+                            st.write(preset)
+                    turn.append(("ai", preset))
+                    show_esc = False
+                else:
+                    # Retrieval, answer cache, history window and LLM request live in chat.py
+                    h_state = st.session_state.setdefault("history_state", {}).setdefault(cid, {})
+                    chat = ChatTurn(prompt, get_cached_messages(cid, refresh=False), llm, answer_cache, h_state)
+                    
+                    if chat.cached:
+                        turn.append(("ai", chat.cached))
+                    else:
+                        save_turn(turn)
+                        turn = []
+                        with st.chat_message("user", avatar=get_avatar("user")):
+                            st.write(prompt)
+                        with st.chat_message("ai", avatar=get_avatar("ai")):
+                            try:
+                                if STREAM_RESPONSES:
+                                    reply = st.write_stream(chat.stream())
+                                else:
+                                    with st.spinner("Skypay AI is working on your answer..."):
+                                        reply = chat.complete()
+                                turn.append(("ai", reply))
+                                chat.finish(reply)
+                            except LLMUnavailableError as e:
+                                print(f"LLM unavailable: {e}")
+                                st.session_state.llm_notice = ("warning", "⏳ SkyPay AI is busy right now. Please try again in a moment.")
+                            except Exception as e:
+                                print(f"LLM error: {e}")
+                                st.session_state.llm_notice = ("error", "Sorry, SkyPay AI could not answer right now. Please try again.")
+        finally:
+            # Runs even when a widget click interrupts the stream with a rerun
+            if turn:
+                save_turn(turn)
+        # End to end, including rendering the streamed answer, tagged with the LLM request size
+        prompt_tokens = chat.prompt_tokens if chat else None
+        TRACER.record("chat.turn", time.perf_counter() - turn_started, {"prompt_tokens": prompt_tokens} if prompt_tokens else None)
+        if not preset:
+            st.rerun()
 
 if not human_active and not is_closed and show_esc:
     st.divider()
@@ -398,12 +391,10 @@ if not human_active and not is_closed and show_esc:
         </div>
     """, unsafe_allow_html=True)
     if st.button("👩‍💻 Talk to a Support Agent"):
-        set_status(cid, "escalated")
-        add_message(cid, "system", "User requested human agent. Support notified.")
-        with st.spinner("Notifying support team via email..."):
-            success = send_escalation_email(ticket_id, user_name, user_email, concern)
-            if success:
-                st.toast(f"Ticket {ticket_id} escalated!", icon="📧")
-            else:
-                st.error("Failed to send email alert. Please check connection.")
+        # Status change and its system message are written in one transaction
+        record_status_change(cid, "escalated", "User requested human agent. Support notified.")
+        # Email goes out in the background with retries; the click returns immediately
+        queue_escalation_email(ticket_id, user_name, user_email, concern)
+        outbox_worker.wake()
+        st.toast(f"Ticket {ticket_id} escalated!", icon="📧")
         st.rerun()
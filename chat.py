@@ -0,0 +1,90 @@
+import hashlib
+import json
+import time
+from knowledge_base import get_knowledge_base
+from llm import count_message_tokens
+from prompts import PRESET_ANSWERS, build_system_prompt
+from history import CHAT_ROLES, fit_history, summarize_turns
+from answer_cache import normalize_question
+
+# Shared by bot.py and benchmarks/load.py, so the load test measures the same code the app runs.
+# Rendering and Mongo writes stay with the caller.
+
+# Every customer answer is generated with these settings
+ANSWER_OPTIONS = {"temperature": 0.1, "max_tokens": 500}
+
+# =========================
+# Presets & Retrieval
+# =========================
+# Matches case, whitespace and punctuation variants of the preset questions
+PRESET_LOOKUP = {normalize_question(q): a for q, a in PRESET_ANSWERS.items()}
+
+def find_preset(prompt):
+    return PRESET_LOOKUP.get(normalize_question(prompt))
+
+def get_fuzzy_context(query):
+    try:
+        return "\n".join(get_knowledge_base().search(query))
+    except: return ""
+
+def prior_turns(messages):
+    # (role, content) transcript without system notes
+    return [t for t in messages if t[0] in CHAT_ROLES]
+
+# =========================
+# Chat Turn
+# =========================
+class ChatTurn:
+    """One free-text customer question: retrieval, answer cache, history window and LLM request.
+
+    `prior` is the conversation so far as (role, content) pairs and
+    `history_state` the per-conversation dict fit_history keeps its running
+    summary in. Check `cached` first; otherwise stream() or complete() the
+    answer and pass it to finish() so it can be reused.
+    """
+
+    def __init__(self, prompt, prior, llm, answer_cache, history_state):
+        self.prompt = prompt
+        self.prior = prior_turns(prior)
+        self.llm = llm
+        self.answer_cache = answer_cache
+        self.history_state = history_state
+        self.ctx = get_fuzzy_context(prompt)
+        # Cached answers are only shared between conversations with the same prior turns
+        self.cached = answer_cache.lookup(prompt, self.ctx, self.prior)
+        self.prompt_tokens = None
+        self.started = None
+
+    def request(self):
+        # (messages, coalesce_key) for the LLM call
+        self.started = time.perf_counter()
+        msgs = [{"role": "system", "content": build_system_prompt(self.ctx)}]
+        # Keep only recent turns within the token budget; older ones live in a running summary
+        summary, recent = fit_history(
+            self.prior + [("user", self.prompt)], self.history_state,
+            lambda prev, turns: summarize_turns(self.llm, prev, turns)
+        )
+        if summary:
+            msgs.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        for r, c in recent:
+            role_map = "assistant" if r in ["ai", "human"] else "user"
+            msgs.append({"role": role_map, "content": c})
+        self.prompt_tokens = count_message_tokens(msgs)
+        # Identical in-flight questions (same context and prior turns) share one completion
+        coalesce_key = hashlib.sha1(
+            json.dumps([normalize_question(self.prompt), msgs[:-1]]).encode("utf-8")
+        ).hexdigest()
+        return msgs, coalesce_key
+
+    def stream(self):
+        # TTFT and total time are recorded by the gateway as llm.ttft / llm.stream spans
+        msgs, coalesce_key = self.request()
+        return self.llm.stream(msgs, coalesce_key=coalesce_key, **ANSWER_OPTIONS)
+
+    def complete(self):
+        msgs, coalesce_key = self.request()
+        return self.llm.complete(msgs, coalesce_key=coalesce_key, **ANSWER_OPTIONS)
+
+    def finish(self, reply):
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        self.answer_cache.store(self.prompt, self.ctx, reply, elapsed, self.prior)
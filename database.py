@@ -1,8 +1,18 @@
 import os
+import re
 import pymongo
 from datetime import datetime, timedelta
 import uuid
+import atexit
+import bisect
+import json
+import zlib
+import threading
+from bson import ObjectId, Binary
+from pymongo.write_concern import WriteConcern
 import streamlit as st
+from tracing import traced, span
+from settings import get_secret
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -16,72 +26,400 @@ def get_db():
     client = pymongo.MongoClient(st.secrets["MONGO_URI"])
     return client["skypay_support"]
 
+# Conversations abandoned before onboarding finishes are removed by a TTL index
+ONBOARDING_TTL = timedelta(hours=24)
+
+# Indexes backing every hot query: (collection, keys, options)
+INDEXES = [
+    ("messages", [("conversation_id", 1), ("seq", 1), ("_id", 1)], {"name": "conversation_seq"}),
+    ("messages", [("conversation_id", 1), ("_id", 1)], {"name": "conversation_id_cursor"}),
+    ("conversations", [("id", 1)], {"name": "id_unique", "unique": True}),
+    ("conversations", [("ticket_id", 1)], {"name": "ticket_id_unique", "unique": True}),
+    ("conversations", [("status", 1), ("created_at", -1), ("id", -1)], {"name": "status_created_at_id"}),
+    ("conversations", [("status", 1), ("search_keys", 1)], {"name": "status_search_keys"}),
+    ("conversations", [("updated_at", 1)], {"name": "updated_at"}),
+    ("conversations", [("status", 1), ("archived_at", 1), ("closed_at", 1)], {"name": "status_archived_closed_at"}),
+    ("conversations", [("created_at", 1)], {
+        "name": "onboarding_ttl",
+        "expireAfterSeconds": int(ONBOARDING_TTL.total_seconds()),
+        "partialFilterExpression": {"status": "onboarding"},
+    }),
+    ("outbox", [("status", 1), ("next_attempt_at", 1)], {"name": "status_next_attempt"}),
+    ("metrics", [("kind", 1), ("day", 1)], {"name": "kind_day"}),
+]
+
+@st.cache_resource
+def _ensure_indexes():
+    # Runs once per process; create_index is a no-op when the index already exists
+    db = get_db()
+    for coll, keys, opts in INDEXES:
+        try:
+            db[coll].create_index(keys, **opts)
+        except pymongo.errors.OperationFailure as e:
+            # e.g. duplicate ticket IDs from before the unique index existed
+            print(f"Index error on {coll}.{opts['name']}: {e}")
+    missing = [
+        f"{coll}.{opts['name']}" for coll, keys, opts in INDEXES
+        if opts["name"] not in db[coll].index_information()
+    ]
+    if missing:
+        print(f"Missing indexes: {', '.join(missing)}")
+    return not missing
+
 def init_db():
     # MongoDB creates collections automatically on first insert
-    pass
+    return _ensure_indexes()
+
+def _has_collscan(plan):
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    children = plan.get("inputStages", []) + [plan[k] for k in ("inputStage", "queryPlan") if k in plan]
+    return any(_has_collscan(c) for c in children)
+
+def verify_query_plans():
+    # Explains each hot query (built by the same helpers the app uses) and raises if any falls back to a collection scan
+    db = get_db()
+    now = datetime.utcnow()
+    page_cursor = (now, "")
+    queries = {
+        "get_messages": db.messages.find({"conversation_id": ""}).sort([("seq", 1), ("_id", 1)]),
+        "get_messages_since": db.messages.find(
+            {"conversation_id": "", "_id": _cursor_filter(ObjectId())}
+        ).sort("_id", 1),
+        "get_conversation_data": db.conversations.find({"id": ""}).limit(1),
+        "search_conversations": _search_cursor(db, "escalated"),
+        "search_conversations (query)": _search_cursor(db, "closed", "sky-2024"),
+        "search_conversations (next page)": _search_cursor(db, "bot", "", page_cursor),
+        "search_conversations (query, next page)": _search_cursor(db, "bot", "ana", page_cursor),
+        "archive_closed_conversations": db.conversations.find(_archivable_filter(now), {"id": 1}),
+        "outbox_claim": db.outbox.find(outbox_due_filter(now)).sort("next_attempt_at", 1).limit(1),
+        "get_support_metrics": db.metrics.find({"kind": "day", "day": {"$gte": ""}}),
+        "change_polling": db.conversations.find({"updated_at": {"$gt": now}}),
+    }
+    scans = [name for name, cursor in queries.items() if _has_collscan(cursor.explain()["queryPlanner"]["winningPlan"])]
+    if scans:
+        raise RuntimeError(f"Collection scan in: {', '.join(scans)}")
+    return True
 
 # =========================
 # 2. Ticket & Conversation Management
 # =========================
+@traced("db.generate_ticket_id")
 def generate_ticket_id():
     db = get_db()
-    # Count documents to generate a sequential ID
-    count = db.conversations.count_documents({}) + 1
     # Philippines Time (UTC+8) for Ticket ID generation
     pht_now = datetime.utcnow() + timedelta(hours=8)
     date_str = pht_now.strftime("%Y%m%d")
-    return f"SKY-{date_str}-{count:04d}"
+    # Atomic per-day counter: constant time and no two sessions get the same number
+    counter = db.counters.find_one_and_update(
+        {"_id": f"ticket-{date_str}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    return f"SKY-{date_str}-{counter['seq']:04d}"
+
+def build_search_keys(ticket_id, name, email):
+    # Lowercase prefixes the dashboard search can match through an index
+    keys = {(ticket_id or "").lower(), (ticket_id or "").split("-")[-1]}
+    if name:
+        keys.add(name.strip().lower())
+        keys.update(name.lower().split())
+    if email:
+        keys.add(email.strip().lower())
+    return sorted(k for k in keys if k)
 
-def create_conversation():
+@traced("db.create_conversation")
+def create_conversation(name=None, concern=None, email=None):
+    # With onboarding details the conversation is written once, already in "bot" status
     db = get_db()
     cid = str(uuid.uuid4())
     tid = generate_ticket_id()
     
-    # Philippine Time for creation timestamp
-    pht_now = datetime.utcnow() + timedelta(hours=8)
+    # Stored as a UTC BSON date; converted to Philippine Time only for display
+    now = datetime.utcnow()
     
     doc = {
         "id": cid,
         "ticket_id": tid,
-        "status": "onboarding",
-        "created_at": pht_now.isoformat(),
-        "user_name": None,
-        "concern": None,
-        "user_email": None
+        "status": "bot" if name else "onboarding",
+        "created_at": now,
+        "user_name": name,
+        "concern": concern,
+        "user_email": email,
+        "updated_at": now
     }
-    db.conversations.insert_one(doc)
+    # The unique ticket_id index guards against clashes with IDs issued before the counter existed
+    for _ in range(5):
+        doc["search_keys"] = build_search_keys(doc["ticket_id"], name, email)
+        try:
+            db.conversations.insert_one(doc)
+            break
+        except pymongo.errors.DuplicateKeyError:
+            doc.pop("_id", None)
+            doc["ticket_id"] = generate_ticket_id()
+    else:
+        raise RuntimeError("Could not allocate a unique ticket ID")
+    if name:
+        _rollup(db, concern, now, {"started": 1})
     return cid
 
+@traced("db.update_onboarding")
 def update_onboarding(cid, name, concern, email):
     db = get_db()
-    db.conversations.update_one(
+    doc = db.conversations.find_one({"id": cid}, {"ticket_id": 1})
+    keys = build_search_keys(doc.get("ticket_id") if doc else None, name, email)
+    before = db.conversations.find_one_and_update(
         {"id": cid},
-        {"$set": {"user_name": name, "concern": concern, "user_email": email, "status": "bot"}}
+        {"$set": {"user_name": name, "concern": concern, "user_email": email, "status": "bot", "search_keys": keys},
+         "$currentDate": {"updated_at": True}},
+        projection=ROLLUP_FIELDS
     )
+    if before:
+        record_transition(db, {**before, "concern": concern}, "bot", datetime.utcnow())
 
-def add_message(conversation_id, role, content):
-    db = get_db()
-    # Use Philippine Time (UTC+8) for message timestamps
-    pht_now = datetime.utcnow() + timedelta(hours=8)
-    msg = {
+def _message_doc(conversation_id, role, content, seq=None):
+    # UTC BSON date; `seq` orders messages within the conversation
+    return {
         "conversation_id": conversation_id,
+        "seq": seq,
         "role": role,
         "content": content,
-        "timestamp": pht_now.isoformat()
+        "timestamp": datetime.utcnow()
     }
+
+def reserve_seq(db, conversation_id, count=1, session=None):
+    # Atomic per-conversation counter: returns the first of `count` consecutive sequence numbers
+    counter = db.counters.find_one_and_update(
+        {"_id": f"messages-{conversation_id}"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER,
+        session=session
+    )
+    return counter["seq"] - count + 1
+
+@traced("db.add_message")
+def add_message(conversation_id, role, content):
+    flush_pending_audit(conversation_id)
+    db = get_db()
+    msg = _message_doc(conversation_id, role, content, reserve_seq(db, conversation_id))
     db.messages.insert_one(msg)
+    if role == "human":
+        record_first_reply(db, conversation_id, msg["timestamp"])
+    # insert_one fills in _id, so callers can cache the message without reading it back
+    return msg
+
+# =========================
+# Conversation Event Writer
+# =========================
+def _events_db():
+    # Optional write concern for conversation events, e.g. EVENT_WRITE_CONCERN = "majority"
+    db = get_db()
+    w = get_secret("EVENT_WRITE_CONCERN")
+    if w is None:
+        return db
+    return db.client.get_database(db.name, write_concern=WriteConcern(w=int(w) if str(w).isdigit() else w))
+
+@traced("db.add_messages")
+def add_messages(conversation_id, messages):
+    # One ordered insert for related messages, e.g. a user turn and its answer
+    if not messages:
+        return []
+    flush_pending_audit(conversation_id)
+    db = _events_db()
+    first = reserve_seq(db, conversation_id, len(messages))
+    docs = [_message_doc(conversation_id, role, content, first + i) for i, (role, content) in enumerate(messages)]
+    db.messages.insert_many(docs, ordered=True)
+    return docs
+
+# Cleared on a standalone mongod, which cannot run multi-document transactions
+_TRANSACTIONS = {"supported": True}
+
+@traced("db.record_status_change")
+def record_status_change(conversation_id, status, system_message=None):
+    # Status update and its system message commit together (transaction when available)
+    flush_pending_audit(conversation_id)
+    db = _events_db()
+    msg = _message_doc(conversation_id, "system", system_message) if system_message else None
+    now = datetime.utcnow()
+    state = {}
+
+    def apply(session=None):
+        state["before"] = _write_status(db, conversation_id, status, now, session)
+        if msg:
+            msg["seq"] = reserve_seq(db, conversation_id, session=session)
+            msg.pop("_id", None)
+            db.messages.insert_one(msg, session=session)
+
+    committed = False
+    if _TRANSACTIONS["supported"]:
+        try:
+            with db.client.start_session() as session:
+                session.with_transaction(apply)
+            committed = True
+        except (pymongo.errors.OperationFailure, NotImplementedError) as e:
+            # IllegalOperation (20): transactions need a replica set or mongos
+            if isinstance(e, pymongo.errors.OperationFailure) and e.code != 20:
+                raise
+            print(f"Transactions unavailable, writing sequentially: {e}")
+            _TRANSACTIONS["supported"] = False
+    if not committed:
+        apply()
+    # Rollups are bumped after the commit: inside the transaction every status change
+    # for a concern would contend on the same day document
+    record_transition(db, state["before"], status, now)
+    return msg
+
+class AuditBuffer:
+    """Buffers system/audit messages and writes them with one insert_many per interval.
+
+    Sequence numbers and _ids are assigned at the first flush attempt, one
+    counter update per conversation in the batch. A failed batch is retried
+    with the same _ids, so rows that already landed are not written twice.
+    Flushes run one at a time, and a batch being written still counts as
+    pending, so flush_pending_audit waits for it.
+    """
+
+    def __init__(self, db, interval=2.0, max_batch=200):
+        self.db = db
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending = []
+        self.in_flight = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, name="audit-buffer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def add(self, conversation_id, content):
+        with self._lock:
+            self.pending.append(_message_doc(conversation_id, "system", content))
+            full = len(self.pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def has_pending(self, conversation_id):
+        with self._lock:
+            return any(doc["conversation_id"] == conversation_id for doc in self.pending + self.in_flight)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, []
+                self.in_flight = batch
+            if not batch:
+                return 0
+            failed = False
+            try:
+                with span("db.audit_flush"):
+                    self._write(batch)
+            except Exception as e:
+                print(f"Audit flush error: {e}")
+                failed = True
+            with self._lock:
+                if failed:
+                    self.pending[:0] = batch
+                self.in_flight = []
+            return len(batch)
+
+    def _write(self, batch):
+        fresh = [doc for doc in batch if doc["seq"] is None]
+        counts = {}
+        for doc in fresh:
+            counts[doc["conversation_id"]] = counts.get(doc["conversation_id"], 0) + 1
+        next_seq = {cid: reserve_seq(self.db, cid, n) for cid, n in counts.items()}
+        for doc in fresh:
+            doc["seq"] = next_seq[doc["conversation_id"]]
+            next_seq[doc["conversation_id"]] += 1
+            doc["_id"] = ObjectId()
+        try:
+            self.db.messages.insert_many(batch, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            # Duplicate _ids are rows a previous attempt already inserted
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+@st.cache_resource
+def get_audit_buffer():
+    return AuditBuffer(_events_db())
+
+def flush_pending_audit(conversation_id):
+    # Keeps per-process write order: buffered messages for this conversation are numbered first
+    buffer = get_audit_buffer()
+    if buffer.has_pending(conversation_id):
+        buffer.flush()
+
+def add_system_message(conversation_id, content, buffered=False):
+    # Buffered messages are written within a couple of seconds instead of on the request path
+    if buffered:
+        get_audit_buffer().add(conversation_id, content)
+        return None
+    return add_message(conversation_id, "system", content)
 
 # =========================
 # 3. Data Retrieval
 # =========================
+@traced("db.get_messages")
 def get_messages(conversation_id):
     db = get_db()
-    cursor = db.messages.find({"conversation_id": conversation_id}).sort("timestamp", 1)
-    return [(doc["role"], doc["content"]) for doc in cursor]
+    cursor = db.messages.find({"conversation_id": conversation_id}).sort([("seq", 1), ("_id", 1)])
+    rows = [(doc["_id"], doc.get("seq"), doc["role"], doc["content"]) for doc in cursor]
+    return [(role, content) for _, _, role, content in _with_archive(db, conversation_id, rows)]
 
-def get_conversation_data(conversation_id):
+# ObjectIds from different processes created in the same second are not strictly
+# ordered, so incremental reads re-check a short window before the cursor
+MESSAGE_CURSOR_OVERLAP = timedelta(seconds=5)
+
+def _cursor_filter(cursor):
+    return {"$gt": ObjectId.from_datetime(cursor.generation_time - MESSAGE_CURSOR_OVERLAP)}
+
+@traced("db.get_messages_since")
+def get_messages_since(conversation_id, cursor=None):
     db = get_db()
-    doc = db.conversations.find_one({"id": conversation_id})
+    query = {"conversation_id": conversation_id}
+    if cursor is not None:
+        query["_id"] = _cursor_filter(cursor)
+    docs = db.messages.find(query, {"seq": 1, "role": 1, "content": 1}).sort("_id", 1)
+    messages = [(doc["_id"], doc.get("seq"), doc["role"], doc["content"]) for doc in docs]
+    if cursor is None:
+        # First read of the transcript: include the archived part, if any (no extra read for live ones)
+        messages = _with_archive(db, conversation_id, messages)
+    return messages
+
+def _message_cache(conversation_id):
+    caches = st.session_state.setdefault("message_cache", {})
+    return caches.setdefault(conversation_id, {"cursor": None, "ids": set(), "messages": []})
+
+def _merge_messages(cache, docs):
+    # The cursor tracks _id (what incremental reads filter on); display order follows seq
+    for _id, seq, role, content in docs:
+        if _id not in cache["ids"]:
+            cache["ids"].add(_id)
+            bisect.insort(cache["messages"], (seq is not None, seq or 0, _id, role, content))
+            if cache["cursor"] is None or _id > cache["cursor"]:
+                cache["cursor"] = _id
+
+def get_cached_messages(conversation_id, refresh=True):
+    # Session-level transcript cache: each refresh only fetches messages after the cursor
+    cache = _message_cache(conversation_id)
+    if refresh:
+        _merge_messages(cache, get_messages_since(conversation_id, cache["cursor"]))
+    return [(role, content) for _, _, _, role, content in cache["messages"]]
+
+def cache_message(msg):
+    # Adds a message this session just wrote (see add_message) to its transcript cache
+    _merge_messages(_message_cache(msg["conversation_id"]), [(msg["_id"], msg.get("seq"), msg["role"], msg["content"])])
+    return msg
+
+def _conversation_fields(doc):
     if doc:
         return (
             doc.get("status", "onboarding"),
@@ -92,74 +430,558 @@ def get_conversation_data(conversation_id):
         )
     return "onboarding", "Guest", "General", "N/A", "N/A"
 
+@traced("db.get_conversation_data")
+def get_conversation_data(conversation_id):
+    db = get_db()
+    doc = db.conversations.find_one({"id": conversation_id})
+    return _conversation_fields(doc)
+
+# Cleared when the server can't run $lookup with both localField and pipeline
+_VIEW_AGGREGATION = {"supported": True}
+
+@traced("db.get_conversation_view")
+def get_conversation_view(conversation_id, since=None):
+    # Conversation metadata plus messages after `since` in a single aggregation round trip
+    if not _VIEW_AGGREGATION["supported"]:
+        return get_conversation_data(conversation_id), get_messages_since(conversation_id, since)
+    db = get_db()
+    message_match = {"_id": _cursor_filter(since)} if since is not None else {}
+    try:
+        docs = _conversation_view_docs(db, conversation_id, message_match)
+    except (pymongo.errors.OperationFailure, NotImplementedError) as e:
+        # MongoDB < 5.0 (and mongomock) lack this $lookup form; use two queries instead
+        print(f"Conversation view aggregation unavailable: {e}")
+        _VIEW_AGGREGATION["supported"] = False
+        return get_conversation_view(conversation_id, since)
+    doc = docs[0] if docs else None
+    messages = [(m["_id"], m.get("seq"), m["role"], m["content"]) for m in doc["messages"]] if doc else []
+    if doc and doc.get("archived_at") and since is None:
+        messages = _with_archive(db, conversation_id, messages)
+    return _conversation_fields(doc), messages
+
+def _conversation_view_docs(db, conversation_id, message_match):
+    return list(db.conversations.aggregate([
+        {"$match": {"id": conversation_id}},
+        {"$limit": 1},
+        {"$project": {"id": 1, "status": 1, "user_name": 1, "concern": 1, "ticket_id": 1, "user_email": 1, "archived_at": 1}},
+        {"$lookup": {
+            "from": "messages",
+            "localField": "id",
+            "foreignField": "conversation_id",
+            "pipeline": [
+                {"$match": message_match},
+                {"$sort": {"_id": 1}},
+                {"$project": {"seq": 1, "role": 1, "content": 1}},
+            ],
+            "as": "messages",
+        }},
+    ]))
+
+def get_cached_conversation(conversation_id):
+    # One round trip per refresh: metadata plus only the new messages, merged into the session cache
+    cache = _message_cache(conversation_id)
+    meta, messages = get_conversation_view(conversation_id, cache["cursor"])
+    _merge_messages(cache, messages)
+    return meta
+
+@traced("db.set_status")
 def set_status(conversation_id, status):
+    change_status(get_db(), conversation_id, status)
+
+@traced("db.claim_ticket")
+def claim_ticket(conversation_id, agent):
+    # Atomic escalated -> human_active transition; only writes when the state actually changes.
+    # Returns True if `agent` holds the ticket afterwards.
     db = get_db()
-    db.conversations.update_one({"id": conversation_id}, {"$set": {"status": status}})
+    result = db.conversations.update_one(
+        {"id": conversation_id, "$or": [
+            {"status": "escalated"},
+            {"status": "human_active", "assigned_agent": None},
+        ]},
+        {"$set": {"status": "human_active", "assigned_agent": agent, "claimed_at": datetime.utcnow()},
+         "$currentDate": {"updated_at": True}}
+    )
+    if result.modified_count:
+        return True
+    return get_assigned_agent(conversation_id) == agent
 
-# NEW: Added to allow monitoring of AI conversations
-def get_ai_active_conversations():
+@traced("db.reassign_ticket")
+def reassign_ticket(conversation_id, from_agent, to_agent):
+    # Conditional on the current owner so two agents cannot both take over
     db = get_db()
-    cursor = db.conversations.find({"status": "bot"}).sort("created_at", -1)
-    return [
-        (
-            doc["id"], 
-            doc.get("user_name"), 
-            doc.get("concern"), 
-            doc.get("ticket_id"), 
-            doc.get("user_email"),
-            doc.get("created_at")
-        )
-        for doc in cursor
-    ]
+    result = db.conversations.update_one(
+        {"id": conversation_id, "status": "human_active", "assigned_agent": from_agent},
+        {"$set": {"assigned_agent": to_agent, "claimed_at": datetime.utcnow()},
+         "$currentDate": {"updated_at": True}}
+    )
+    return result.modified_count == 1
 
-def get_escalated_conversations():
-    db = get_db()
-    cursor = db.conversations.find(
-        {"status": {"$in": ["escalated", "human_active"]}}
-    ).sort("created_at", -1)
-    return [
-        (
-            doc["id"], 
-            doc.get("user_name"), 
-            doc.get("concern"), 
-            doc.get("ticket_id"), 
-            doc.get("user_email"),
-            doc.get("created_at")
-        )
-        for doc in cursor
-    ]
+@traced("db.get_assigned_agent")
+def get_assigned_agent(conversation_id):
+    db = get_db()
+    doc = db.conversations.find_one({"id": conversation_id}, {"assigned_agent": 1})
+    return doc.get("assigned_agent") if doc else None
 
-def get_closed_conversations():
-    db = get_db()
-    cursor = db.conversations.find({"status": "closed"}).sort("created_at", -1)
-    return [
-        (
-            doc["id"], 
-            doc.get("user_name"), 
-            doc.get("concern"), 
-            doc.get("ticket_id"), 
-            doc.get("user_email"),
-            doc.get("created_at")
-        )
+# Dashboard list views: only the fields the sidebar cards display
+STATUS_GROUPS = {
+    "bot": ["bot"],
+    "escalated": ["escalated", "human_active"],
+    "closed": ["closed"],
+}
+CONVERSATION_FIELDS = {"_id": 0, "id": 1, "user_name": 1, "concern": 1, "ticket_id": 1, "user_email": 1, "created_at": 1}
+
+@traced("db.search_conversations")
+def search_conversations(group, query="", after=None, page_size=25):
+    """Return one page of conversations in a status group, newest first.
+
+    `query` is matched as a prefix of the ticket ID, ticket number, email or any
+    name word. `after` is the (created_at, id) cursor of the previous page's last
+    row. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    cursor = _search_cursor(get_db(), group, query, after, page_size)
+    rows = [
+        (doc["id"], doc.get("user_name"), doc.get("concern"), doc.get("ticket_id"), doc.get("user_email"), doc.get("created_at"))
         for doc in cursor
     ]
+    next_cursor = (rows[page_size - 1][5], rows[page_size - 1][0]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+def _search_cursor(db, group, query="", after=None, page_size=25):
+    filt = {"status": {"$in": STATUS_GROUPS[group]}}
+    q = (query or "").strip().lower()
+    if q:
+        filt["search_keys"] = {"$regex": "^" + re.escape(q)}
+    if after:
+        created_at, cid = after
+        filt["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": cid}},
+        ]
+    return (
+        db.conversations.find(filt, CONVERSATION_FIELDS)
+        .sort([("created_at", -1), ("id", -1)])
+        .limit(page_size + 1)
+    )
+
+def backfill_search_keys(batch_size=500):
+    # One-off job for conversations created before search_keys existed
+    db = get_db()
+    updated = 0
+    while True:
+        docs = list(db.conversations.find(
+            {"search_keys": {"$exists": False}}, {"id": 1, "ticket_id": 1, "user_name": 1, "user_email": 1}
+        ).limit(batch_size))
+        if not docs:
+            return updated
+        db.conversations.bulk_write([
+            pymongo.UpdateOne(
+                {"_id": d["_id"]},
+                {"$set": {"search_keys": build_search_keys(d.get("ticket_id"), d.get("user_name"), d.get("user_email"))}}
+            )
+            for d in docs
+        ])
+        updated += len(docs)
+
+def _legacy_datetime(value, doc):
+    # Old documents hold isoformat() strings of Philippine Time (UTC+8)
+    try:
+        return datetime.fromisoformat(value) - timedelta(hours=8)
+    except (TypeError, ValueError):
+        return doc["_id"].generation_time.replace(tzinfo=None) if isinstance(doc["_id"], ObjectId) else datetime.utcnow()
+
+def migrate_timestamps(batch_size=500):
+    """One-off job: rewrite string timestamps as UTC dates and number legacy messages.
+
+    Safe to re-run and to run while the apps are live. Legacy messages are
+    numbered below any sequence already assigned in their conversation (zero
+    and down), so they keep sorting before messages written since.
+    Returns counts of updated documents.
+    """
+    db = get_db()
+    counts = {"conversations": 0, "messages": 0, "sequenced": 0}
+    for coll, field, key in (("conversations", "created_at", "conversations"), ("messages", "timestamp", "messages")):
+        while True:
+            docs = list(db[coll].find({field: {"$type": "string"}}, {field: 1}).limit(batch_size))
+            if not docs:
+                break
+            db[coll].bulk_write([
+                pymongo.UpdateOne({"_id": d["_id"]}, {"$set": {field: _legacy_datetime(d[field], d)}})
+                for d in docs
+            ])
+            counts[key] += len(docs)
+    while True:
+        cids = [
+            g["_id"] for g in db.messages.aggregate([
+                {"$match": {"seq": None}},
+                {"$group": {"_id": "$conversation_id"}},
+                {"$limit": batch_size},
+            ])
+        ]
+        if not cids:
+            return counts
+        for cid in cids:
+            docs = list(db.messages.find({"conversation_id": cid, "seq": None}, {"_id": 1}).sort([("timestamp", 1), ("_id", 1)]))
+            lowest = db.messages.find_one({"conversation_id": cid, "seq": {"$ne": None}}, {"seq": 1}, sort=[("seq", 1)])
+            first = min(lowest["seq"], 1) - len(docs) if lowest else 1 - len(docs)
+            db.messages.bulk_write([
+                pymongo.UpdateOne({"_id": d["_id"]}, {"$set": {"seq": first + i}}) for i, d in enumerate(docs)
+            ])
+            counts["sequenced"] += len(docs)
 
 def close_conversation(conversation_id):
     set_status(conversation_id, "closed")
 
+# =========================
+# Transcript Archive
+# =========================
+# Closed conversations older than this are packed into one compressed
+# `archive` document and their messages leave the hot collection
+ARCHIVE_AFTER = timedelta(days=30)
+
+def _pack_timestamp(value):
+    # Always UTC with an explicit "Z"; unmigrated Philippine Time strings are converted first
+    at = _as_utc(value)
+    return at.isoformat() + "Z" if at else None
+
+def _unpack_timestamp(value):
+    if isinstance(value, str) and value.endswith("Z"):
+        return datetime.fromisoformat(value[:-1])
+    return _as_utc(value)
+
+def _pack_transcript(messages):
+    rows = [
+        {"_id": str(m["_id"]), "seq": m.get("seq"), "role": m["role"], "content": m["content"],
+         "timestamp": _pack_timestamp(m.get("timestamp"))}
+        for m in messages
+    ]
+    return Binary(zlib.compress(json.dumps(rows).encode("utf-8"), 6))
+
+def _unpack_transcript(data):
+    messages = json.loads(zlib.decompress(data).decode("utf-8"))
+    for m in messages:
+        m["_id"] = ObjectId(m["_id"])
+        m["timestamp"] = _unpack_timestamp(m["timestamp"])
+    return messages
+
+def load_archived_messages(db, conversation_id):
+    # Archived transcript in display order, or [] when the conversation is not archived
+    doc = db.archive.find_one({"_id": conversation_id}, {"transcript": 1})
+    if not doc:
+        return []
+    messages = _unpack_transcript(doc["transcript"])
+    messages.sort(key=lambda m: (m["seq"] is not None, m["seq"] or 0, m["_id"]))
+    return messages
+
+def _with_archive(db, conversation_id, rows):
+    # Hot (_id, seq, role, content) rows merged with the archived transcript, in display order.
+    # Messages written after archiving (e.g. a late audit flush) stay hot and sort after it.
+    # Archiving moves every message, so a hot seq 1 means there is no archive to read.
+    if any(row[1] == 1 for row in rows):
+        return rows
+    merged = {m["_id"]: (m["_id"], m["seq"], m["role"], m["content"]) for m in load_archived_messages(db, conversation_id)}
+    if not merged:
+        return rows
+    merged.update((row[0], row) for row in rows)
+    return sorted(merged.values(), key=lambda r: (r[1] is not None, r[1] or 0, r[0]))
+
+def archive_conversation(db, conversation_id):
+    """Move one closed conversation's messages into its archive document.
+
+    Safe to re-run after a crash at any step: messages already in the archive
+    are merged by _id, and the conversation is only marked archived after its
+    hot messages are gone.
+    """
+    messages = list(db.messages.find({"conversation_id": conversation_id}))
+    if messages:
+        archived = {m["_id"]: m for m in load_archived_messages(db, conversation_id)}
+        archived.update({m["_id"]: m for m in messages})
+        db.archive.replace_one(
+            {"_id": conversation_id},
+            {"_id": conversation_id, "transcript": _pack_transcript(list(archived.values())),
+             "message_count": len(archived), "archived_at": datetime.utcnow()},
+            upsert=True
+        )
+        db.messages.delete_many({"_id": {"$in": [m["_id"] for m in messages]}})
+    # The message counter is kept, so anything written later continues the sequence
+    db.conversations.update_one({"id": conversation_id}, {"$set": {"archived_at": datetime.utcnow()}})
+    return len(messages)
+
+def _archivable_filter(cutoff):
+    return {"status": "closed", "archived_at": None, "$or": [
+        {"closed_at": {"$lt": cutoff}},
+        # Closed before closed_at was recorded (backfill_metrics stamps it on old conversations)
+        {"closed_at": None, "updated_at": {"$lt": cutoff}},
+        {"closed_at": None, "updated_at": None, "created_at": {"$lt": cutoff}},
+    ]}
+
+@traced("db.archive_closed_conversations")
+def archive_closed_conversations(older_than=ARCHIVE_AFTER, batch_size=100):
+    """Archive every closed conversation closed more than `older_than` ago. Returns the count.
+
+    Archived conversations are read-only: get_messages and the cached
+    transcript reads merge the archive with any hot messages.
+    """
+    db = get_db()
+    query = _archivable_filter(datetime.utcnow() - older_than)
+    archived = 0
+    while True:
+        ids = [d["id"] for d in db.conversations.find(query, {"id": 1}).limit(batch_size)]
+        if not ids:
+            return archived
+        for cid in ids:
+            try:
+                archive_conversation(db, cid)
+                archived += 1
+            except Exception as e:
+                print(f"Archive error for {cid}: {e}")
+                # Leave it for the next run rather than retrying in this loop
+                query.setdefault("id", {"$nin": []})["$nin"].append(cid)
+
+# =========================
+# Support Metrics Rollups
+# =========================
+# One "day" document per Philippine-Time day and concern, with per-hour
+# sub-counters, plus one "queue" depth gauge per concern. Counters are bumped
+# as transitions happen, so the dashboard reads O(days x concerns) documents.
+QUEUE_STATUSES = ("escalated", "human_active")
+ROLLUP_FIELDS = {"status": 1, "concern": 1, "created_at": 1, "escalated_at": 1}
+
+def _pht_bucket(at):
+    pht = at + timedelta(hours=8)
+    return pht.strftime("%Y-%m-%d"), pht.strftime("%H")
+
+def _as_utc(value):
+    # Handles unmigrated isoformat() strings of Philippine Time as well as dates
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value) - timedelta(hours=8)
+    except (TypeError, ValueError):
+        return None
+
+def _rollup(db, concern, at, counters, depth=0):
+    concern = concern or "General"
+    if counters:
+        day, hour = _pht_bucket(at)
+        inc = {}
+        for key, value in counters.items():
+            inc[f"totals.{key}"] = value
+            inc[f"hours.{hour}.{key}"] = value
+        db.metrics.update_one(
+            {"_id": f"day:{day}:{concern}"},
+            {"$inc": inc, "$setOnInsert": {"kind": "day", "day": day, "concern": concern}},
+            upsert=True
+        )
+    if depth:
+        db.metrics.update_one(
+            {"_id": f"queue:{concern}"},
+            {"$inc": {"depth": depth}, "$setOnInsert": {"kind": "queue", "concern": concern}},
+            upsert=True
+        )
+
+def _write_status(db, conversation_id, status, at, session=None):
+    # Status write that returns the previous state, so rollups cost no extra read
+    update = {"$set": {"status": status}, "$currentDate": {"updated_at": True}}
+    if status == "escalated":
+        update["$min"] = {"escalated_at": at}
+    elif status == "closed":
+        update["$set"]["closed_at"] = at
+    return db.conversations.find_one_and_update(
+        {"id": conversation_id}, update, projection=ROLLUP_FIELDS, session=session
+    )
+
+def change_status(db, conversation_id, status):
+    now = datetime.utcnow()
+    before = _write_status(db, conversation_id, status, now)
+    record_transition(db, before, status, now)
+    return before
+
+def record_transition(db, before, status, at):
+    if not before or before.get("status") == status:
+        return
+    prev = before.get("status")
+    counters, depth = {}, 0
+    if prev == "onboarding" and status == "bot":
+        counters["started"] = 1
+    if status in QUEUE_STATUSES and prev not in QUEUE_STATUSES:
+        counters["escalated"] = 1
+        depth = 1
+    elif prev in QUEUE_STATUSES and status not in QUEUE_STATUSES:
+        depth = -1
+    if status == "closed":
+        counters["closed"] = 1
+        created = _as_utc(before.get("created_at"))
+        if created:
+            counters["resolved"] = 1
+            counters["resolution_seconds"] = (at - created).total_seconds()
+    _rollup(db, before.get("concern"), at, counters, depth)
+
+def record_first_reply(db, conversation_id, at):
+    # Only the first human message of a conversation matches the filter
+    before = db.conversations.find_one_and_update(
+        {"id": conversation_id, "first_human_at": None},
+        {"$set": {"first_human_at": at}},
+        projection={"concern": 1, "escalated_at": 1}
+    )
+    if before and isinstance(before.get("escalated_at"), datetime):
+        _rollup(db, before.get("concern"), at, {
+            "first_replies": 1, "first_reply_seconds": (at - before["escalated_at"]).total_seconds()
+        })
+
+@traced("db.get_support_metrics")
+def get_support_metrics(days=7):
+    """Queue metrics for the last `days` Philippine-Time days, read only from rollups.
+
+    Returns (by_day, by_concern, queue_depth): the first two map a day or a
+    concern to summed counters; queue_depth maps concern to open tickets.
+    """
+    db = get_db()
+    start = _pht_bucket(datetime.utcnow() - timedelta(days=days - 1))[0]
+    by_day, by_concern = {}, {}
+    for doc in db.metrics.find({"kind": "day", "day": {"$gte": start}}, {"hours": 0}):
+        for target in (by_day.setdefault(doc["day"], {}), by_concern.setdefault(doc["concern"], {})):
+            for key, value in doc.get("totals", {}).items():
+                target[key] = target.get(key, 0) + value
+    queue = {doc["concern"]: doc.get("depth", 0) for doc in db.metrics.find({"kind": "queue"})}
+    return by_day, by_concern, queue
+
+# System notes written by older versions, used when a conversation has no escalated_at/closed_at
+LEGACY_ESCALATION_NOTES = ("requested human agent", "manually joined")
+LEGACY_CLOSE_NOTE = "closed this ticket"
+
+def _conversation_events(db, conversation_ids):
+    events = {}
+    for m in db.messages.find(
+        {"conversation_id": {"$in": conversation_ids}, "role": {"$in": ["human", "system"]}},
+        {"conversation_id": 1, "role": 1, "content": 1, "timestamp": 1}
+    ):
+        at = _as_utc(m.get("timestamp"))
+        if at is None:
+            continue
+        content = (m.get("content") or "").lower()
+        if m["role"] == "human":
+            kind = "first_human_at"
+        elif any(note in content for note in LEGACY_ESCALATION_NOTES):
+            kind = "escalated_at"
+        elif LEGACY_CLOSE_NOTE in content:
+            kind = "closed_at"
+        else:
+            continue
+        found = events.setdefault(m["conversation_id"], {})
+        if kind not in found or at < found[kind]:
+            found[kind] = at
+    return events
+
+def backfill_metrics(batch_size=500):
+    """Rebuild the metrics rollups from conversations and messages.
+
+    One-off (or repair) job that scans the full history. Stop the apps while
+    it runs: the rebuilt rollups are written to a scratch collection and
+    swapped in with one rename, so the dashboard never sees partial numbers,
+    but increments the apps make during the scan land in the old collection
+    and are dropped with it. It also stamps escalated_at / first_human_at / closed_at
+    on old conversations, so later replies are not counted as first replies
+    and tickets closed by older versions become due for archiving.
+    Returns the number of conversations scanned.
+    """
+    db = get_db()
+    days, queue = {}, {}
+
+    def add(concern, at, counters):
+        day, hour = _pht_bucket(at)
+        doc = days.setdefault((day, concern), {"_id": f"day:{day}:{concern}", "kind": "day", "day": day,
+                                               "concern": concern, "totals": {}, "hours": {}})
+        for key, value in counters.items():
+            doc["totals"][key] = doc["totals"].get(key, 0) + value
+            bucket = doc["hours"].setdefault(hour, {})
+            bucket[key] = bucket.get(key, 0) + value
+
+    scanned, last_id = 0, None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        convs = list(db.conversations.find(
+            query, {"id": 1, "status": 1, "concern": 1, "created_at": 1, "updated_at": 1,
+                    "escalated_at": 1, "first_human_at": 1, "closed_at": 1}
+        ).sort("_id", 1).limit(batch_size))
+        if not convs:
+            break
+        last_id = convs[-1]["_id"]
+        events = _conversation_events(db, [c["id"] for c in convs])
+        stamps = []
+        for c in convs:
+            status, concern = c.get("status", "onboarding"), c.get("concern") or "General"
+            ev = events.get(c["id"], {})
+            created = _as_utc(c.get("created_at"))
+            escalated = _as_utc(c.get("escalated_at")) or ev.get("escalated_at")
+            first_human = _as_utc(c.get("first_human_at")) or ev.get("first_human_at")
+            if status in QUEUE_STATUSES and escalated is None:
+                escalated = created
+            if created and status != "onboarding":
+                add(concern, created, {"started": 1})
+            if escalated:
+                add(concern, escalated, {"escalated": 1})
+                if first_human and first_human >= escalated:
+                    add(concern, first_human, {"first_replies": 1,
+                                               "first_reply_seconds": (first_human - escalated).total_seconds()})
+            closed = None
+            if status == "closed":
+                closed = _as_utc(c.get("closed_at")) or ev.get("closed_at") or _as_utc(c.get("updated_at")) or created
+                if closed:
+                    counters = {"closed": 1}
+                    if created:
+                        counters.update({"resolved": 1, "resolution_seconds": (closed - created).total_seconds()})
+                    add(concern, closed, counters)
+            if status in QUEUE_STATUSES:
+                queue[concern] = queue.get(concern, 0) + 1
+            stamp = {
+                k: v for k, v in (("escalated_at", escalated), ("first_human_at", first_human), ("closed_at", closed))
+                if v and not c.get(k)
+            }
+            if stamp:
+                stamps.append(pymongo.UpdateOne({"_id": c["_id"]}, {"$set": stamp}))
+        if stamps:
+            db.conversations.bulk_write(stamps)
+        scanned += len(convs)
+
+    docs = list(days.values()) + [
+        {"_id": f"queue:{concern}", "kind": "queue", "concern": concern, "depth": depth}
+        for concern, depth in queue.items()
+    ]
+    rebuild = db.metrics_rebuild
+    rebuild.drop()
+    for coll, keys, opts in INDEXES:
+        if coll == "metrics":
+            rebuild.create_index(keys, **opts)
+    if docs:
+        rebuild.insert_many(docs)
+        rebuild.rename("metrics", dropTarget=True)
+    else:
+        db.metrics.delete_many({})
+    return scanned
+
 # =========================
 # 4. Email Notification (With Time Fix)
 # =========================
-def send_escalation_email(ticket_id, user_name, user_email, concern):
-    # Credentials from Streamlit Secrets
-    sender_email = st.secrets["EMAIL_USER"]
-    password = st.secrets["EMAIL_PASS"]
-    receiver_email = "jm.trinchera@skypay.ph" 
+def get_smtp_settings():
+    # SMTP host is configurable so a local debug server (e.g. aiosmtpd) can stand in
+    return {
+        "host": get_secret("SMTP_HOST", "smtp.gmail.com"),
+        "port": int(get_secret("SMTP_PORT", 587)),
+        "starttls": bool(get_secret("SMTP_STARTTLS", True)),
+        "user": get_secret("EMAIL_USER", ""),
+        "password": get_secret("EMAIL_PASS", ""),
+        "recipient": get_secret("ESCALATION_RECIPIENT", "jm.trinchera@skypay.ph"),
+    }
 
-    # FIX: Manually add 8 hours for Philippine Time
-    pht_time = datetime.utcnow() + timedelta(hours=8)
-    pht_str = pht_time.strftime('%Y-%m-%d %I:%M %p')
+def open_smtp(settings):
+    server = smtplib.SMTP(settings["host"], settings["port"], timeout=20)
+    if settings["starttls"]:
+        server.starttls()
+    if settings["password"]:
+        server.login(settings["user"], settings["password"])
+    return server
 
+def build_escalation_email(ticket_id, user_name, user_email, concern, pht_str, sender, recipient):
     subject = f"CHAT ESCALATION: {ticket_id} - {user_name}"
     body = f"""
     🚨 NEW CHAT ESCALATION
@@ -172,17 +994,57 @@ def send_escalation_email(ticket_id, user_name, user_email, concern):
     """
 
     msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
+    msg['From'] = sender
+    msg['To'] = recipient
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+def _pht_now_str():
+    # FIX: Manually add 8 hours for Philippine Time
+    pht_time = datetime.utcnow() + timedelta(hours=8)
+    return pht_time.strftime('%Y-%m-%d %I:%M %p')
+
+@traced("email.send")
+def send_escalation_email(ticket_id, user_name, user_email, concern):
+    # Synchronous delivery; the chat uses queue_escalation_email instead
+    settings = get_smtp_settings()
+    msg = build_escalation_email(
+        ticket_id, user_name, user_email, concern, _pht_now_str(), settings["user"], settings["recipient"]
+    )
 
     try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(sender_email, password)
+        with open_smtp(settings) as server:
             server.send_message(msg)
         return True
     except Exception as e:
         print(f"Email error: {e}")
         return False
+
+def outbox_due_filter(now):
+    # Pending messages that are due, plus sends whose lease expired (the worker crashed mid-send)
+    return {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now}},
+        {"status": "sending", "locked_until": {"$lt": now}},
+    ]}
+
+@traced("db.queue_escalation_email")
+def queue_escalation_email(ticket_id, user_name, user_email, concern):
+    # Written to the outbox and delivered in the background by mailer.OutboxWorker
+    db = get_db()
+    now = datetime.utcnow()
+    db.outbox.insert_one({
+        "kind": "escalation",
+        "payload": {
+            "ticket_id": ticket_id,
+            "user_name": user_name,
+            "user_email": user_email,
+            "concern": concern,
+            "pht_str": _pht_now_str(),
+        },
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    })
+    return True
@@ -0,0 +1,60 @@
+from llm import count_tokens
+
+HISTORY_TOKEN_BUDGET = 1200
+SUMMARY_MAX_TOKENS = 200
+CHAT_ROLES = ("user", "ai", "human")
+
+def _turn_tokens(turn):
+    return count_tokens(turn[1]) + 4
+
+# =========================
+# Running Summary
+# =========================
+def summarize_turns(llm, previous, turns, max_tokens=SUMMARY_MAX_TOKENS):
+    transcript = "\n".join(f"{'Customer' if r == 'user' else 'Support'}: {c}" for r, c in turns)
+    try:
+        summary = llm.complete(
+            [
+                {"role": "system", "content": "Summarize this SkyPay support chat in a few sentences. Keep names, ticket details and unresolved questions."},
+                {"role": "user", "content": f"Earlier summary: {previous or 'None'}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature=0,
+            max_tokens=max_tokens,
+        )
+        return summary.strip()
+    except Exception as e:
+        print(f"Summary error: {e}")
+        # Fall back to the most recent text so the summary stays bounded
+        return f"{previous} {transcript}".strip()[-max_tokens * 4:]
+
+# =========================
+# History Window
+# =========================
+def fit_history(turns, state, summarize, budget=HISTORY_TOKEN_BUDGET):
+    """Return (summary, recent_turns) keeping recent turns within `budget` tokens.
+
+    Older turns are folded into a running summary cached in `state`. When the
+    window overflows it is trimmed to half the budget, so the summary is only
+    recomputed every few turns rather than on every message.
+    """
+    turns = [t for t in turns if t[0] in CHAT_ROLES]
+    folded = state.get("folded", 0)
+    if folded > len(turns):
+        state.clear()
+        folded = 0
+
+    recent = turns[folded:]
+    if sum(_turn_tokens(t) for t in recent) > budget:
+        keep, used = 0, 0
+        for turn in reversed(recent):
+            used += _turn_tokens(turn)
+            if keep and used > budget // 2:
+                break
+            keep += 1
+        new_folded = len(turns) - keep
+        if new_folded > folded:
+            state["summary"] = summarize(state.get("summary", ""), turns[folded:new_folded])
+            state["folded"] = new_folded
+            recent = turns[new_folded:]
+
+    return state.get("summary", ""), recent
@@ -0,0 +1,169 @@
+import os
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+import numpy as np
+import streamlit as st
+from thefuzz import process, fuzz
+from tracing import traced
+from settings import get_secret
+
+KNOWLEDGE_FILE = "knowledge.txt"
+# "fuzzy" (token_set_ratio over candidate lines) or "bm25" (sparse matrix scoring)
+DEFAULT_BACKEND = "fuzzy"
+
+# Words too common to narrow down candidate lines
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for",
+    "from", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "the",
+    "to", "what", "when", "where", "who", "why", "with", "you", "your",
+}
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9@.+ ]+", " ", text.lower()).strip()
+
+def tokenize(text):
+    return [t.strip(".") for t in normalize(text).split() if t.strip(".") and t.strip(".") not in STOPWORDS]
+
+# =========================
+# BM25 Matrix
+# =========================
+class BM25Matrix:
+    """BM25 weights for every (line, term) pair, stored column-wise (CSC) in NumPy arrays.
+
+    Built once per knowledge file load. Scoring a query is one sparse
+    matrix-vector product: the query's term columns are gathered and summed
+    per line with a single bincount.
+    """
+
+    def __init__(self, docs, k1=1.5, b=0.75):
+        self.docs = docs
+        postings = {}
+        lengths = np.zeros(len(docs), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            tokens = tokenize(doc)
+            lengths[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((i, tf))
+        self.vocab = {term: j for j, term in enumerate(postings)}
+        df = np.array([len(p) for p in postings.values()], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(df)))
+        self.indices = np.array([i for p in postings.values() for i, _ in p], dtype=np.int64)
+        tf = np.array([tf for p in postings.values() for _, tf in p], dtype=np.float32)
+        idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = max(float(lengths.mean()), 1.0) if len(docs) else 1.0
+        norm = k1 * (1 - b + b * lengths[self.indices] / avgdl)
+        self.data = np.repeat(idf, df) * tf * (k1 + 1) / (tf + norm)
+
+    def scores(self, weights):
+        # weights: {term: query weight}; terms outside the vocabulary are ignored
+        cols = [(self.vocab[t], w) for t, w in weights.items() if t in self.vocab]
+        if not cols:
+            return np.zeros(len(self.docs), dtype=np.float32)
+        rows = np.concatenate([self.indices[self.indptr[j]:self.indptr[j + 1]] for j, _ in cols])
+        vals = np.concatenate([self.data[self.indptr[j]:self.indptr[j + 1]] * w for j, w in cols])
+        return np.bincount(rows, weights=vals, minlength=len(self.docs))
+
+# =========================
+# Knowledge Base Engine
+# =========================
+# Everything built from one read of the file. A reload swaps in a new snapshot
+# as a single reference, so a running query never mixes old and new lines.
+Snapshot = namedtuple("Snapshot", ["lines", "index", "matrix", "mtime"])
+
+class KnowledgeBase:
+    def __init__(self, path=KNOWLEDGE_FILE, check_interval=2.0, backend=DEFAULT_BACKEND):
+        self.path = path
+        self.check_interval = check_interval
+        self.backend = backend
+        self.snapshot = Snapshot([], {}, None, None)
+        self.last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        # Only stat the file every few seconds; reload only when mtime changes
+        now = time.monotonic()
+        if not force and now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if not force and mtime == self.snapshot.mtime:
+            return
+        with self._lock:
+            self._load(mtime)
+
+    def _load(self, mtime):
+        lines = []
+        if mtime is not None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = [l.strip() for l in f.readlines() if len(l.strip()) > 10]
+        index = {}
+        for i, line in enumerate(lines):
+            for token in set(tokenize(line)):
+                index.setdefault(token, set()).add(i)
+        matrix = None
+        if self.backend == "bm25":
+            try:
+                matrix = BM25Matrix(lines)
+            except Exception as e:
+                print(f"BM25 build error, using fuzzy search: {e}")
+        self.snapshot = Snapshot(lines, index, matrix, mtime)
+
+    def query_terms(self, query, index=None):
+        # {vocabulary term: weight}; unknown words map onto close terms to tolerate typos
+        index = self.snapshot.index if index is None else index
+        terms = {}
+        for token in set(tokenize(query)):
+            if token in index:
+                terms[token] = 1.0
+            elif len(token) > 3:
+                for term, score in process.extract(token, index.keys(), scorer=fuzz.ratio, limit=3):
+                    if score >= 80:
+                        terms[term] = max(terms.get(term, 0.0), score / 100)
+        return terms
+
+    def candidates(self, query, snapshot=None):
+        snapshot = snapshot or self.snapshot
+        lines, index = snapshot.lines, snapshot.index
+        ids = set()
+        for term in self.query_terms(query, index):
+            ids |= index[term]
+        return [lines[i] for i in sorted(ids)]
+
+    def fuzzy_search(self, query, limit=3, threshold=60, snapshot=None):
+        pool = self.candidates(query, snapshot)
+        if not pool:
+            return []
+        matches = process.extract(query, pool, scorer=fuzz.token_set_ratio, limit=limit)
+        return [m[0] for m in matches if m[1] > threshold]
+
+    def bm25_search(self, query, limit=3, min_ratio=0.5, snapshot=None):
+        # Lines scoring at least `min_ratio` of the best match, best first
+        snapshot = snapshot or self.snapshot
+        matrix = snapshot.matrix
+        if not matrix.docs:
+            return []
+        scores = matrix.scores(self.query_terms(query, snapshot.index))
+        best = scores.max()
+        if best <= 0:
+            return []
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return [matrix.docs[i] for i in top if scores[i] >= best * min_ratio]
+
+    @traced("retrieval")
+    def search(self, query, limit=3, threshold=60):
+        self.refresh()
+        snapshot = self.snapshot
+        if snapshot.matrix is not None:
+            return self.bm25_search(query, limit, snapshot=snapshot)
+        # Default backend, and the fallback if the BM25 matrix could not be built
+        return self.fuzzy_search(query, limit, threshold, snapshot)
+
+@st.cache_resource
+def get_knowledge_base():
+    return KnowledgeBase(backend=get_secret("RETRIEVAL_BACKEND", DEFAULT_BACKEND))
@@ -0,0 +1,221 @@
+import random
+import time
+import threading
+import groq
+import httpx
+import streamlit as st
+from tracing import TRACER, span
+from settings import get_secret
+
+MODEL = "llama-3.1-8b-instant"
+
+# Rough token estimate (~4 chars per token for English); avoids shipping a tokenizer
+def count_tokens(text):
+    return (len(text or "") + 3) // 4
+
+def count_message_tokens(messages):
+    # Each chat message carries a few tokens of role/format overhead
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+# =========================
+# LLM Gateway
+# =========================
+class LLMUnavailableError(Exception):
+    pass
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def _is_retryable(e):
+    if isinstance(e, groq.APIConnectionError):
+        return True
+    return getattr(e, "status_code", None) in RETRY_STATUS
+
+def _retry_after(e):
+    try:
+        return float(e.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class _Flight:
+    # One upstream completion shared by every request with the same coalesce key
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def put(self, delta):
+        with self.cond:
+            self.chunks.append(delta)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.cond:
+                while i >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                pending = self.chunks[i:]
+                done, error = self.done, self.error
+            yield from pending
+            i += len(pending)
+            if done and i >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+class LLMGateway:
+    """Process-wide entry point for chat completions.
+
+    Wraps any client exposing `chat.completions.create` (the Groq SDK, or a
+    Groq client pointed at a local OpenAI-compatible fake via LLM_BASE_URL)
+    with a bounded concurrency semaphore, a queueing timeout and jittered
+    retries on 429/5xx/connection errors. Calls that pass the same
+    `coalesce_key` while one is in flight share that single upstream call.
+    """
+
+    def __init__(self, client, max_concurrency=8, queue_timeout=20, max_retries=3, retry_base=0.5):
+        self.client = client
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.stats = {"calls": 0, "retries": 0, "rejected": 0, "failed": 0, "coalesced": 0}
+        self._stats_lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+
+    def _count(self, name):
+        # Request and fill threads all update the counters
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def summary(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _acquire(self):
+        with span("llm.queue"):
+            acquired = self.slots.acquire(timeout=self.queue_timeout)
+        if not acquired:
+            self._count("rejected")
+            raise LLMUnavailableError("Too many requests in flight")
+
+    def _create(self, **kwargs):
+        # Only the request itself is retried; tokens already streamed are never replayed
+        kwargs.setdefault("model", MODEL)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._count("calls")
+                return self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    self._count("failed")
+                    if _is_retryable(e):
+                        raise LLMUnavailableError(str(e)) from e
+                    raise
+                self._count("retries")
+                delay = _retry_after(e) or random.uniform(0, self.retry_base * 2 ** attempt)
+                time.sleep(min(delay, 10))
+
+    def _coalesced(self, key, produce, stats):
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._count("coalesced")
+        if leader:
+            # The upstream call runs on its own thread so no single caller can stall the others
+            threading.Thread(target=self._fill, args=(key, flight, produce), daemon=True).start()
+        start = time.perf_counter()
+        ttft = None
+        for delta in flight:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            yield delta
+        stats["ttft"] = ttft
+        stats["total"] = time.perf_counter() - start
+
+    def _fill(self, key, flight, produce):
+        error = None
+        try:
+            for delta in produce():
+                flight.put(delta)
+        except Exception as e:
+            error = e
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.finish(error)
+
+    def complete(self, messages, coalesce_key=None, **kwargs):
+        with span("llm.complete"):
+            if coalesce_key is None:
+                return self._complete(messages, **kwargs)
+            key = (coalesce_key, tuple(sorted(kwargs.items())))
+            return "".join(self._coalesced(key, lambda: [self._complete(messages, **kwargs)], {}))
+
+    def stream(self, messages, stats=None, coalesce_key=None, **kwargs):
+        # Yields text deltas as they arrive; fills `stats` with ttft/total seconds when done
+        stats = {} if stats is None else stats
+        if coalesce_key is None:
+            deltas = self._stream(messages, stats, **kwargs)
+        else:
+            key = (coalesce_key, tuple(sorted(kwargs.items())))
+            deltas = self._coalesced(key, lambda: self._stream(messages, {}, **kwargs), stats)
+        return self._traced(deltas, stats) if TRACER.enabled else deltas
+
+    def _traced(self, deltas, stats):
+        # Spans as seen by the caller, including queueing and any shared in-flight call
+        with span("llm.stream"):
+            yield from deltas
+        TRACER.record("llm.ttft", stats.get("ttft"))
+
+    def _complete(self, messages, **kwargs):
+        self._acquire()
+        try:
+            completion = self._create(messages=messages, **kwargs)
+            return completion.choices[0].message.content
+        finally:
+            self.slots.release()
+
+    def _stream(self, messages, stats, **kwargs):
+        self._acquire()
+        try:
+            start = time.perf_counter()
+            ttft = None
+            for chunk in self._create(messages=messages, stream=True, **kwargs):
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    yield delta
+            stats["ttft"] = ttft
+            stats["total"] = time.perf_counter() - start
+        finally:
+            self.slots.release()
+
+@st.cache_resource
+def get_llm():
+    # One Groq client per process so HTTP connections are kept alive and reused
+    max_concurrency = int(get_secret("LLM_MAX_CONCURRENCY", 8))
+    client = groq.Groq(
+        api_key=st.secrets["GROQ_API_KEY"],
+        base_url=get_secret("LLM_BASE_URL"),
+        timeout=float(get_secret("LLM_TIMEOUT", 30)),
+        max_retries=0,
+        http_client=httpx.Client(limits=httpx.Limits(
+            max_connections=max_concurrency, max_keepalive_connections=max_concurrency, keepalive_expiry=60
+        )),
+    )
+    return LLMGateway(client, max_concurrency=max_concurrency)
@@ -0,0 +1,139 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+import pymongo
+import streamlit as st
+from database import get_db, get_smtp_settings, open_smtp, build_escalation_email, outbox_due_filter
+from tracing import span
+
+MAX_ATTEMPTS = 6
+BATCH_SIZE = 20
+# Short pause after the first due email so a burst of escalations shares one send cycle
+BATCH_WINDOW = 0.5
+POLL_INTERVAL = 2.0
+IDLE_TIMEOUT = 60
+# A worker that dies mid-send releases its claim after this long
+LEASE = timedelta(minutes=2)
+
+def backoff(attempts):
+    return min(10 * 2 ** (attempts - 1), 900) * random.uniform(0.8, 1.2)
+
+# =========================
+# Outbox Worker
+# =========================
+class OutboxWorker:
+    """Delivers queued outbox emails over one reused, authenticated SMTP connection.
+
+    Every process may run a worker; each email is claimed with an atomic
+    find_one_and_update, so it is sent by exactly one of them. Failures are
+    retried with jittered exponential backoff up to MAX_ATTEMPTS.
+    """
+
+    def __init__(self, db, settings, poll_interval=POLL_INTERVAL):
+        self.db = db
+        self.settings = settings
+        self.poll_interval = poll_interval
+        self.server = None
+        self.last_used = 0.0
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "connections": 0}
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, name="outbox-worker", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        return self.db.outbox.find_one_and_update(
+            outbox_due_filter(now),
+            {"$set": {"status": "sending", "locked_until": now + LEASE}},
+            sort=[("next_attempt_at", 1)],
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+
+    def _connection(self):
+        if self.server is not None:
+            try:
+                self.server.noop()
+            except Exception:
+                self._close()
+        if self.server is None:
+            self.server = open_smtp(self.settings)
+            self.stats["connections"] += 1
+        return self.server
+
+    def _close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+    def _deliver(self, doc):
+        now = datetime.utcnow()
+        try:
+            with span("email.send", ticket_id=doc["payload"].get("ticket_id")):
+                msg = build_escalation_email(
+                    **doc["payload"], sender=self.settings["user"], recipient=self.settings["recipient"]
+                )
+                self._connection().send_message(msg)
+            self.last_used = time.monotonic()
+        except Exception as e:
+            print(f"Email error: {e}")
+            self._close()
+            attempts = doc.get("attempts", 0) + 1
+            if attempts >= MAX_ATTEMPTS:
+                update = {"status": "failed"}
+                self.stats["failed"] += 1
+            else:
+                update = {"status": "pending", "next_attempt_at": now + timedelta(seconds=backoff(attempts))}
+                self.stats["retried"] += 1
+            update.update({"attempts": attempts, "last_error": str(e)})
+            self.db.outbox.update_one({"_id": doc["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+        else:
+            self.db.outbox.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {"status": "sent", "sent_at": now}, "$unset": {"locked_until": ""}}
+            )
+            self.stats["sent"] += 1
+
+    def run_once(self):
+        doc = self._claim()
+        if doc is None:
+            return 0
+        time.sleep(BATCH_WINDOW)
+        # Claimed one at a time, just before sending, so a slow SMTP server can't
+        # run out the lease of emails still waiting here for another worker to take
+        sent = 0
+        while doc is not None:
+            self._deliver(doc)
+            sent += 1
+            if sent >= BATCH_SIZE:
+                break
+            doc = self._claim()
+        return sent
+
+    def _run(self):
+        while True:
+            try:
+                sent = self.run_once()
+            except Exception as e:
+                print(f"Outbox error: {e}")
+                sent = 0
+            if not sent:
+                if self.server is not None and time.monotonic() - self.last_used > IDLE_TIMEOUT:
+                    self._close()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+@st.cache_resource
+def get_outbox_worker():
+    return OutboxWorker(get_db(), get_smtp_settings())
+
+if __name__ == "__main__":
+    # Dedicated worker process: python mailer.py (reads .streamlit/secrets.toml)
+    get_outbox_worker()
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,10 @@
+# One-off data migrations for documents written by older versions.
+# Usage: python migrate.py   (reads MONGO_URI from .streamlit/secrets.toml)
+# Stop the apps first: the metrics rebuild drops rollup increments made while it runs.
+from database import init_db, backfill_search_keys, migrate_timestamps, backfill_metrics
+
+if __name__ == "__main__":
+    init_db()
+    print(f"Search keys added: {backfill_search_keys()}")
+    print(f"Timestamps migrated: {migrate_timestamps()}")
+    print(f"Metrics rebuilt from {backfill_metrics()} conversations")
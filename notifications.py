@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+import pymongo
+from bson import ObjectId
+import streamlit as st
+from database import get_db
+
+# Version key bumped whenever any conversation document changes (dashboard lists)
+LIST_KEY = "__conversations__"
+POLL_INTERVAL = 2.0
+# Writes from other processes can land slightly out of order, so polling re-reads a short window
+POLL_OVERLAP = timedelta(seconds=5)
+
+# =========================
+# Change Notifier
+# =========================
+class ChangeNotifier:
+    """One background watcher per process that turns Mongo writes into version bumps.
+
+    Uses a change stream when the server supports it (replica set / Atlas) and
+    falls back to polling indexed `_id` / `updated_at` fields on a standalone
+    mongod. Sessions compare version numbers in memory instead of querying.
+    """
+
+    def __init__(self, db, poll_interval=POLL_INTERVAL):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.versions = defaultdict(int)
+        self.mode = "starting"
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        threading.Thread(target=self._run, name="change-notifier", daemon=True).start()
+
+    def version(self, *keys):
+        with self._lock:
+            return tuple(self.versions[k] for k in keys)
+
+    def bump(self, conversation_id, list_changed=False):
+        with self._lock:
+            if conversation_id:
+                self.versions[conversation_id] += 1
+            if list_changed:
+                self.versions[LIST_KEY] += 1
+
+    def acknowledge(self, conversation_id, message_ids):
+        # Messages written by this process: bump now, and skip them when the watcher sees them later
+        for _id in message_ids:
+            self._first_sighting(_id)
+        self.bump(conversation_id)
+
+    def _run(self):
+        failures = 0
+        while failures < 3:
+            try:
+                self._watch()
+                failures = 0
+            except pymongo.errors.OperationFailure as e:
+                # Standalone servers do not support change streams
+                print(f"Change stream unavailable, polling instead: {e}")
+                break
+            except Exception as e:
+                failures += 1
+                print(f"Change stream error: {e}")
+                time.sleep(self.poll_interval)
+        self._poll()
+
+    def _watch(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": ["messages", "conversations"]},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }}]
+        with self.db.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "change_stream"
+            for change in stream:
+                doc = change.get("fullDocument") or {}
+                if change["ns"]["coll"] == "messages":
+                    if self._first_sighting(doc.get("_id")):
+                        self.bump(doc.get("conversation_id"))
+                else:
+                    self.bump(doc.get("id"), list_changed=True)
+
+    def _first_sighting(self, key):
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen[key] = True
+            while len(self._seen) > 10000:
+                self._seen.popitem(last=False)
+            return True
+
+    def _poll(self):
+        self.mode = "polling"
+        since = datetime.utcnow()
+        while True:
+            start = datetime.utcnow()
+            try:
+                window = since - POLL_OVERLAP
+                for doc in self.db.messages.find(
+                    {"_id": {"$gt": ObjectId.from_datetime(window)}}, {"conversation_id": 1}
+                ):
+                    if self._first_sighting(doc["_id"]):
+                        self.bump(doc.get("conversation_id"))
+                for doc in self.db.conversations.find(
+                    {"updated_at": {"$gt": window}}, {"id": 1, "updated_at": 1}
+                ):
+                    if self._first_sighting((doc.get("id"), doc["updated_at"])):
+                        self.bump(doc.get("id"), list_changed=True)
+                since = start
+            except Exception as e:
+                print(f"Change polling error: {e}")
+            time.sleep(self.poll_interval)
+
+@st.cache_resource
+def get_notifier():
+    return ChangeNotifier(get_db())
+
+# =========================
+# Session Hook
+# =========================
+def rerun_on_change(*keys, interval=1.0):
+    """Rerun the whole app only when one of `keys` changed since this run.
+
+    Call before reading the data the page shows. The fragment below only
+    compares in-memory version numbers, so idle tabs issue no DB queries.
+    """
+    notifier = get_notifier()
+    st.session_state.watch_versions = (keys, notifier.version(*keys))
+
+    @st.fragment(run_every=interval)
+    def _check_for_changes():
+        seen_keys, seen = st.session_state.get("watch_versions", (None, None))
+        if seen_keys == keys and notifier.version(*keys) != seen:
+            st.rerun()
+
+    _check_for_changes()
+
+def mark_own_writes(conversation_id, messages):
+    """Record messages this session just wrote so they don't rerun it a second time.
+
+    The bump happens now and the session's snapshot is refreshed to include
+    it; the watcher then skips these messages when it sees them.
+    """
+    notifier = get_notifier()
+    notifier.acknowledge(conversation_id, [m["_id"] for m in messages if m])
+    keys, _ = st.session_state.get("watch_versions", (None, None))
+    if keys is not None:
+        st.session_state.watch_versions = (keys, notifier.version(*keys))
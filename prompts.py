@@ -0,0 +1,41 @@
+import hashlib
+
+OFF_TOPIC = "I'm sorry, but I can only answer inquiries regarding SkyPay services. I cannot assist with general knowledge questions."
+UNSURE = "I'm not sure about that yet, but I can help escalate it."
+
+# =========================
+# Static Rules (built once at import)
+# =========================
+STATIC_RULES = (
+    "You are a strict customer support agent for SkyPay. "
+    "Your ONLY purpose is to answer questions about SkyPay services using the provided context.\n"
+    "RULES:\n"
+    "1. Use the context naturally without referring to it by name. Do NOT include citation markers like [1] or [source].\n"
+    f"2. If the answer is not in the context, reply: '{UNSURE}' Do not invent steps or offer troubleshooting (like 'clear your cache') that is not in the context.\n"
+    f"3. If the question is unrelated to SkyPay, reply: '{OFF_TOPIC}'\n"
+    "4. SkyPay is B2B infrastructure. There is NO user dashboard, NO login page, and NO mobile app for customers.\n"
+    "5. NEVER ask the user for their GCash number, bank account, password, or OTP.\n"
+    "6. You have no access to live user data. NEVER claim to check the system, look up an account, or find transactions.\n"
+    "7. For a specific transaction issue, tell the user to contact cs@skypay.ph or escalate to a human agent."
+)
+
+# FAQ buttons in the chat UI, answered without retrieval or an LLM call
+PRESET_ANSWERS = {
+    "What is SkyPay?": "Established in August 2018, Skybridge Payment, Inc. (SKYPAY) is a Philippines-based fintech company specializing in payment gateway services. We are a BSP-licensed Operator of Payment System (OPS) and SEC-registered firm providing B2B payment infrastructure for merchants, lenders, and partners.",
+    "Is SkyPay a scam?": "No, SKYPAY is a legitimate SEC-registered and BSP-licensed fintech firm. Only accredited partners like 7-Eleven, GCash, or Maya are authorized to collect on our behalf. Do not entertain unauthorized persons instructing you to settle payments to personal accounts.",
+    "What are SkyPay office hours?": "Our office hours are Monday to Friday, 9:00 AM to 6:00 PM Philippine Time. We are closed on weekends and holidays.",
+    "What are SkyPay's services?": "We offer OTC and digital collection/disbursement solutions, cash payouts, and bill payments for over 200 partners. Value-added services include Buy Load, Top Up, and Cash In.",
+    "How do I contact SkyPay support?": "Reach us via email at cs@skypay.ph, landline at +63 5328 5320, or mobile at +63 927 558 0175 (Globe) and +63 999 590 3042 (Smart).",
+    "Is SkyPay a loaning company?": "No, SKYPAY is NOT a loaning or lending company. We act solely as a technology bridge; any money received for loans originates from third-party lenders who use our routing system."
+}
+
+# Changes whenever the rules change; used to invalidate cached answers
+PROMPT_VERSION = hashlib.sha1(STATIC_RULES.encode("utf-8")).hexdigest()[:8]
+
+# Token budget for the system prompt excluding context (checked in tests/test_prompts.py).
+# Currently ~265; kept just above that so any growth of the rules is a deliberate change here
+STATIC_PROMPT_TOKEN_LIMIT = 270
+
+def build_system_prompt(ctx):
+    # Context goes last and exactly once so the static prefix stays identical across requests
+    return f"{STATIC_RULES}\n\nContext:\n{ctx or 'No relevant context found.'}"
@@ -0,0 +1,8 @@
+import streamlit as st
+
+def get_secret(name, default=None):
+    # st.secrets raises when no secrets file exists (scripts, benchmarks, tests), so fall back to the default
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
@@ -0,0 +1,35 @@
+import pytest
+from answer_cache import AnswerCache
+from knowledge_base import KNOWLEDGE_FILE, KnowledgeBase
+
+@pytest.fixture(scope="module")
+def kb():
+    return KnowledgeBase(KNOWLEDGE_FILE)
+
+def context(kb, question):
+    return "\n".join(kb.search(question))
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Where can I pay my SkyPay loan?", "When can I pay my SkyPay loan?"),
+    ("Who are SkyPay partners?", "Where are SkyPay partners?"),
+    ("Is SkyPay a lending company?", "Is SkyPay a lending company or not?"),
+])
+def test_different_questions_miss(kb, cached, asked):
+    cache = AnswerCache()
+    ctx = context(kb, cached)
+    cache.store(cached, ctx, "cached answer")
+    assert cache.lookup(asked, context(kb, asked)) is None
+
+def test_case_and_punctuation_variants_hit(kb):
+    cache = AnswerCache()
+    question = "Where can I pay my SkyPay loan?"
+    ctx = context(kb, question)
+    cache.store(question, ctx, "cached answer")
+    assert cache.lookup("  where can i pay my SKYPAY loan ", ctx) == "cached answer"
+
+def test_answers_are_not_shared_across_prior_turns(kb):
+    cache = AnswerCache()
+    question = "Where can I pay my SkyPay loan?"
+    ctx = context(kb, question)
+    cache.store(question, ctx, "cached answer", history=[("user", "hi"), ("ai", "hello")])
+    assert cache.lookup(question, ctx) is None
@@ -0,0 +1,21 @@
+from llm import count_tokens
+from prompts import STATIC_PROMPT_TOKEN_LIMIT, STATIC_RULES, build_system_prompt
+
+CONTEXT = "\n".join([
+    "SkyPay Office Hours: Monday to Friday, 9:00 AM to 6:00 PM. Closed on weekends and holidays.",
+    "Email: cs@skypay.ph",
+    "SkyPay is NOT a loaning or lending company.",
+])
+
+def test_system_prompt_stays_within_budget():
+    prompt = build_system_prompt(CONTEXT)
+    assert count_tokens(prompt) - count_tokens(CONTEXT) <= STATIC_PROMPT_TOKEN_LIMIT
+
+def test_context_appears_exactly_once():
+    prompt = build_system_prompt(CONTEXT)
+    assert prompt.count(CONTEXT) == 1
+    assert prompt.startswith(STATIC_RULES)
+
+def test_empty_context_keeps_static_prefix():
+    assert build_system_prompt("").startswith(STATIC_RULES)
+    assert build_system_prompt(None) == build_system_prompt("")
@@ -0,0 +1,55 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import pymongo
+import pytest
+
+import database
+
+CREATES = 2000
+WORKERS = 32
+
+def _serialized(method, lock):
+    def wrapper(*args, **kwargs):
+        with lock:
+            return method(*args, **kwargs)
+    return wrapper
+
+@pytest.fixture
+def db(monkeypatch):
+    # TEST_MONGO_URI runs against a real server; otherwise mongomock, whose writes are
+    # made atomic per call the way a mongod's single-document updates are
+    uri = os.environ.get("TEST_MONGO_URI")
+    if uri:
+        client = pymongo.MongoClient(uri)
+    else:
+        lock = threading.RLock()
+        for name in ("find_one_and_update", "insert_one", "update_one"):
+            monkeypatch.setattr(mongomock.Collection, name, _serialized(getattr(mongomock.Collection, name), lock))
+        client = mongomock.MongoClient()
+    db = client["skypay_support_test"]
+    client.drop_database(db.name)
+    monkeypatch.setattr(database, "get_db", lambda: db)
+    for coll, keys, opts in database.INDEXES:
+        db[coll].create_index(keys, **opts)
+    yield db
+    client.drop_database(db.name)
+
+def test_parallel_ticket_ids_are_unique(db):
+    with ThreadPoolExecutor(WORKERS) as pool:
+        ids = list(pool.map(lambda _: database.generate_ticket_id(), range(CREATES)))
+    assert len(set(ids)) == CREATES
+    assert sorted(int(t.rsplit("-", 1)[1]) for t in ids) == list(range(1, CREATES + 1))
+
+def test_parallel_conversations_get_unique_tickets(db):
+    def create(i):
+        return database.create_conversation(f"User {i}", "Inquiries", f"u{i}@example.com")
+
+    with ThreadPoolExecutor(WORKERS) as pool:
+        cids = list(pool.map(create, range(CREATES)))
+    tickets = [d["ticket_id"] for d in db.conversations.find({}, {"ticket_id": 1})]
+    assert len(set(cids)) == CREATES
+    assert len(tickets) == CREATES
+    assert len(set(tickets)) == CREATES
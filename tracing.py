@@ -0,0 +1,215 @@
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from settings import get_secret
+
+# Arguments copied onto spans by @traced
+TAG_PARAMS = ("conversation_id", "ticket_id")
+MAX_EXPORT_BYTES = 5 * 1024 * 1024
+
+# Tags for every span in the current script run (conversation_id / ticket_id)
+_context_tags = contextvars.ContextVar("trace_tags", default={})
+
+def set_trace_tags(**tags):
+    _context_tags.set({k: v for k, v in tags.items() if v is not None})
+
+# =========================
+# Spans
+# =========================
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def tag(self, **tags):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    __slots__ = ("tracer", "name", "tags", "start")
+
+    def __init__(self, tracer, name, tags):
+        self.tracer = tracer
+        self.name = name
+        self.tags = tags
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, time.perf_counter() - self.start, self.tags, error=exc_type is not None)
+        return False
+
+class Tracer:
+    """Records timed spans into an in-memory ring buffer.
+
+    With an export directory, a background thread appends new spans to
+    spans-<pid>.jsonl and rewrites stages-<pid>.prom (Prometheus text format)
+    every few seconds, so the dashboard can also read other app processes.
+    When disabled, span() returns a shared no-op object and nothing is stored.
+    """
+
+    def __init__(self, enabled=True, maxlen=5000, export_dir=None, export_interval=5.0):
+        self.enabled = enabled
+        self.spans = deque(maxlen=maxlen)
+        self.export_dir = export_dir
+        self.export_interval = export_interval
+        self._pending = deque(maxlen=maxlen)
+        if enabled and export_dir:
+            threading.Thread(target=self._export_loop, name="trace-export", daemon=True).start()
+
+    def span(self, name, **tags):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, {**_context_tags.get(), **tags})
+
+    def record(self, name, duration, tags=None, error=False):
+        if not self.enabled or duration is None:
+            return
+        entry = {**_context_tags.get(), **(tags or {}), "ts": time.time(), "stage": name, "ms": round(duration * 1000, 3)}
+        if error:
+            entry["error"] = True
+        # deque appends are atomic, so the hot path takes no lock
+        self.spans.append(entry)
+        if self.export_dir:
+            self._pending.append(entry)
+
+    def _export_path(self, kind, ext):
+        return os.path.join(self.export_dir, f"{kind}-{os.getpid()}.{ext}")
+
+    def export(self):
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        if not batch:
+            return 0
+        os.makedirs(self.export_dir, exist_ok=True)
+        path = self._export_path("spans", "jsonl")
+        if os.path.exists(path) and os.path.getsize(path) > MAX_EXPORT_BYTES:
+            os.replace(path, path + ".1")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(to_jsonl(batch))
+        prom = self._export_path("stages", "prom")
+        with open(prom + ".tmp", "w", encoding="utf-8") as f:
+            f.write(to_prometheus(stage_summary(list(self.spans))))
+        os.replace(prom + ".tmp", prom)
+        return len(batch)
+
+    def _export_loop(self):
+        while True:
+            time.sleep(self.export_interval)
+            try:
+                self.export()
+            except Exception as e:
+                print(f"Trace export error: {e}")
+
+    def recent(self, window):
+        # This process's spans plus the exported spans of other processes within `window` seconds
+        since = time.time() - window
+        spans = [s for s in list(self.spans) if s["ts"] >= since]
+        if self.export_dir:
+            own = self._export_path("spans", "jsonl")
+            for path in glob.glob(os.path.join(self.export_dir, "spans-*.jsonl")):
+                if path != own and os.path.getmtime(path) >= since:
+                    spans.extend(s for s in _read_tail(path) if s.get("ts", 0) >= since)
+        return spans
+
+def _read_tail(path, size=256 * 1024):
+    with open(path, "rb") as f:
+        f.seek(max(0, os.path.getsize(path) - size))
+        lines = f.read().decode("utf-8", "replace").splitlines()
+    spans = []
+    for line in lines[1:] if len(lines) > 1 else lines:
+        try:
+            spans.append(json.loads(line))
+        except ValueError:
+            pass
+    return spans
+
+# Module-level so decorators applied at import time can check it cheaply.
+# Export is opt-in: set TRACE_EXPORT_DIR to share spans between app processes.
+# TRACE_BUFFER_SIZE bounds the in-memory spans (the load test raises it to keep a whole run).
+TRACER = Tracer(
+    enabled=bool(get_secret("TRACING_ENABLED", True)),
+    maxlen=int(get_secret("TRACE_BUFFER_SIZE", 5000)),
+    export_dir=get_secret("TRACE_EXPORT_DIR") or None,
+)
+
+def span(name, **tags):
+    return TRACER.span(name, **tags)
+
+def traced(name):
+    """Decorator: time each call as a span, tagged with any conversation_id / ticket_id argument."""
+    def decorate(fn):
+        params = list(inspect.signature(fn).parameters)
+        positions = [(p, params.index(p)) for p in TAG_PARAMS if p in params]
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            tags = {}
+            for param, i in positions:
+                value = kwargs.get(param, args[i] if i < len(args) else None)
+                if value is not None:
+                    tags[param] = value
+            with TRACER.span(name, **tags):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# =========================
+# Summaries & Export Formats
+# =========================
+def percentile(values, p):
+    # Nearest-rank percentile (p in 0-100) of an unsorted sequence; None when empty
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def stage_summary(spans):
+    by_stage = {}
+    for s in spans:
+        by_stage.setdefault(s["stage"], []).append(s)
+    summary = {}
+    for stage, items in sorted(by_stage.items()):
+        ms = sorted(s["ms"] for s in items)
+        summary[stage] = {
+            "count": len(ms),
+            "errors": sum(1 for s in items if s.get("error")),
+            "p50_ms": percentile(ms, 50),
+            "p95_ms": percentile(ms, 95),
+            "max_ms": ms[-1],
+            "sum_ms": round(sum(ms), 3),
+        }
+    return summary
+
+def to_jsonl(spans):
+    return "".join(json.dumps(s, default=str) + "\n" for s in spans)
+
+def to_prometheus(summary):
+    lines = [
+        "# HELP skypay_stage_duration_seconds Recent span durations per stage",
+        "# TYPE skypay_stage_duration_seconds summary",
+    ]
+    for stage, v in summary.items():
+        label = f'stage="{stage}"'
+        lines.append(f'skypay_stage_duration_seconds{{{label},quantile="0.5"}} {v["p50_ms"] / 1000:.6f}')
+        lines.append(f'skypay_stage_duration_seconds{{{label},quantile="0.95"}} {v["p95_ms"] / 1000:.6f}')
+        lines.append(f"skypay_stage_duration_seconds_sum{{{label}}} {v['sum_ms'] / 1000:.6f}")
+        lines.append(f"skypay_stage_duration_seconds_count{{{label}}} {v['count']}")
+    return "\n".join(lines) + "\n"